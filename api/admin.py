@@ -1,11 +1,17 @@
 from django.contrib import admin
 from django.urls import reverse
+from django.utils.html import format_html, format_html_join
 from django.utils.safestring import mark_safe
 
 from datetime import timedelta
 from urllib.parse import urlencode
 
+from requests.exceptions import RequestException
+
+from api.analysis import get_shortest_paths
 from api.models import Puzzle, Solution
+from api.tmdb_client import TMDBUnavailable
+from api.utils import get_many_info, movie_info_key, persons_info_key
 
 
 @admin.register(Puzzle)
@@ -23,6 +29,8 @@ class PuzzleAdmin(admin.ModelAdmin):
         'link_to_solution_list',
     )
     list_display = readonly_fields + ('date_active', )
+    # Looks up the names on the sample paths, too slow for every row of the list.
+    readonly_fields += ('shortest_paths', )
     fieldsets = (
         ('Films', {
             'fields': (
@@ -38,7 +46,10 @@ class PuzzleAdmin(admin.ModelAdmin):
                 ('num_solved', 'num_solutions', 'link_to_solution_list'),
                 ('shortest_solution', 'longest_solution', 'average_steps', 'median_steps'),
             )
-        })
+        }),
+        ('Analysis', {
+            'fields': ('shortest_paths', )
+        }),
     )
     ordering = ('-date_active', )
 
@@ -82,6 +93,36 @@ class PuzzleAdmin(admin.ModelAdmin):
             return mark_safe(f'<a href={url}>Add a solution</a>')
         return '-'
 
+    def shortest_paths(self, obj):
+        if not all([getattr(obj, i) for i in ('id', 'start_movie_id', 'end_movie_id')]):
+            return '-'
+        paths = get_shortest_paths(obj.start_movie_id, obj.end_movie_id)
+        if paths is None:
+            return 'Not counted yet, run manage.py count_puzzle_paths'
+        try:
+            info = get_many_info(
+                movie_ids={node_id for path in paths['sample_paths'] for node_id in path[::2]},
+                person_ids={node_id for path in paths['sample_paths'] for node_id in path[1::2]},
+            )
+        except (RequestException, TMDBUnavailable) as exc:
+            return f'Unavailable: {exc}'
+        if paths['shortest_path_steps'] is None:
+            return 'No path within the search limit'
+
+        def names(path):
+            return ' > '.join(
+                info[movie_info_key(node_id)]['title'] if index % 2 == 0
+                else info[persons_info_key(node_id)]['name']
+                for index, node_id in enumerate(path)
+            )
+
+        return format_html(
+            '{} shortest paths of {} steps, such as:<br>{}',
+            paths['num_shortest_paths'],
+            paths['shortest_path_steps'],
+            format_html_join(mark_safe('<br>'), '{}', ((names(path), ) for path in paths['sample_paths'])),
+        )
+
 
 @admin.register(Solution)
 class SolutionAdmin(admin.ModelAdmin):
@@ -108,6 +149,23 @@ class SolutionAdmin(admin.ModelAdmin):
 
     list_filter = ('puzzle', )
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # The solution may have been moved from another puzzle.
+        puzzle_ids = [pk for pk in (obj.puzzle_id, form.initial.get('puzzle')) if pk]
+        for puzzle in Puzzle.objects.filter(pk__in=puzzle_ids):
+            puzzle.rebuild_length_histogram()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        obj.puzzle.rebuild_length_histogram()
+
+    def delete_queryset(self, request, queryset):
+        puzzles = list(Puzzle.objects.filter(solution__in=queryset).distinct())
+        super().delete_queryset(request, queryset)
+        for puzzle in puzzles:
+            puzzle.rebuild_length_histogram()
+
     def puzzle_link(self, obj):
         if obj.puzzle:
             url = reverse('admin:api_puzzle_change', args=(obj.puzzle.id, ))
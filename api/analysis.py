@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.exceptions import NotFound
+
+from api.helpers import BidirectionalSearch, Node
+from api.utils import find_puzzle_and_datetime
+
+
+def shortest_paths_key(start_movie_id, end_movie_id):
+    return f'shortest_paths:{start_movie_id}:{end_movie_id}'
+
+
+def summarize_search(search, path):
+    """
+    Returns how many steps the shortest paths found by a finished search take,
+    how many of them there are and a few picked at random.
+    """
+    return {
+        'shortest_path_steps': len(path) - 1 if path else None,
+        'num_shortest_paths': search.num_shortest_paths,
+        'sample_paths': [
+            [node_id for _, node_id in sample]
+            for sample in search.sample_paths(settings.PUZZLE_PATHS_SAMPLES)
+        ],
+    }
+
+
+def find_shortest_paths(start_movie_id, end_movie_id, expand_level):
+    """
+    Counts the shortest paths between two films with one search.
+    Paths are counted level by level rather than listed,
+    so this costs the same however many there are.
+    This can take thousands of requests to tmdb, so it's only run offline.
+    """
+    search = BidirectionalSearch(
+        (Node.Type.FILM, start_movie_id),
+        (Node.Type.FILM, end_movie_id),
+        settings.PUZZLE_PATHS_MAX_STEPS,
+        expand_level,
+    )
+    return summarize_search(search, search.run())
+
+
+def cache_shortest_paths(start_movie_id, end_movie_id, paths):
+    caches['default'].set(
+        shortest_paths_key(start_movie_id, end_movie_id),
+        paths,
+        settings.PUZZLE_PATHS_TIMEOUT_IN_SECONDS,
+    )
+
+
+def get_shortest_paths(start_movie_id, end_movie_id):
+    """
+    Returns the counted shortest paths between two films, or None if they haven't been counted
+    """
+    return caches['default'].get(shortest_paths_key(start_movie_id, end_movie_id))
+
+
+def get_puzzle_paths_metrics(request, puzzle_id=None):
+    puzzle, _ = find_puzzle_and_datetime(request, puzzle_id)
+    paths = get_shortest_paths(puzzle.start_movie_id, puzzle.end_movie_id)
+    if paths is None:
+        raise NotFound('The shortest paths of this puzzle have not been counted yet.')
+    return {
+        'id': puzzle.id,
+        'max_steps': settings.PUZZLE_PATHS_MAX_STEPS,
+        **paths,
+    }
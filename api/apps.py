@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from api.utils import get_geoip
+
+        # Open the GeoIP database once, before any workers are forked.
+        get_geoip()
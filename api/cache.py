@@ -0,0 +1,429 @@
+import asyncio
+import functools
+import logging
+import pickle
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from api.tmdb_client import is_transient
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+# Writes deferred by prime_cache run here, one batch at a time.
+priming_executor = ThreadPoolExecutor(max_workers=1)
+
+# Background refreshes of memoized results past their soft timeout.
+revalidation_executor = ThreadPoolExecutor(max_workers=4)
+
+# How long one process may hold a key it's revalidating before another may try.
+REVALIDATION_LOCK_TIMEOUT = 60
+
+
+# Local tiers by LOCATION. Django makes a cache instance per thread
+# (and per async context), so they're kept here to be shared by the process.
+local_tiers = {}
+local_tiers_lock = threading.Lock()
+
+
+class LocalTier:
+    def __init__(self):
+        self.local = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+class TieredCache(BaseCache):
+    """
+    Cache backend with a bounded, per-process LRU in front of a shared backend.
+
+    LOCATION is the alias of the shared cache in settings.CACHES.
+    Values are kept locally for at most OPTIONS['LOCAL_TIMEOUT'] seconds,
+    so another process's writes can take that long to be seen here.
+    The local tier holds at most MAX_ENTRIES values and MAX_SIZE pickled bytes,
+    evicting the least recently used first.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = location
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 60)
+        self.max_size = options.get('MAX_SIZE', 64 * 1024 * 1024)
+        with local_tiers_lock:
+            self.tier = local_tiers.setdefault(location, LocalTier())
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def stats(self):
+        with self.tier.lock:
+            return {
+                'local_hits': self.tier.local_hits,
+                'shared_hits': self.tier.shared_hits,
+                'misses': self.tier.misses,
+                'evictions': self.tier.evictions,
+                'entries': len(self.tier.local),
+                'size': self.tier.size,
+            }
+
+    def get_local(self, local_key):
+        with self.tier.lock:
+            entry = self.tier.local.get(local_key)
+            if entry is None:
+                return MISSING
+            expires, pickled = entry
+            if expires is not None and expires <= time.time():
+                self.discard_local(local_key)
+                return MISSING
+            self.tier.local.move_to_end(local_key)
+            self.tier.local_hits += 1
+        return pickle.loads(pickled)
+
+    def set_local(self, local_key, value, timeout=DEFAULT_TIMEOUT):
+        expires = self.get_backend_timeout(timeout)
+        local_expires = time.time() + self.local_timeout
+        if expires is None or expires > local_expires:
+            expires = local_expires
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(pickled) > self.max_size:
+            return
+        with self.tier.lock:
+            self.discard_local(local_key)
+            self.tier.local[local_key] = (expires, pickled)
+            self.tier.size += len(pickled)
+            while len(self.tier.local) > self._max_entries or self.tier.size > self.max_size:
+                _, (_, evicted) = self.tier.local.popitem(last=False)
+                self.tier.size -= len(evicted)
+                self.tier.evictions += 1
+
+    def discard_local(self, local_key):
+        entry = self.tier.local.pop(local_key, None)
+        if entry is not None:
+            self.tier.size -= len(entry[1])
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version)
+        if added:
+            self.set_local(self.make_key(key, version), value, timeout)
+        return added
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_key(key, version)
+        value = self.get_local(local_key)
+        if value is not MISSING:
+            return value
+        value = self.shared.get(key, MISSING, version)
+        if value is MISSING:
+            with self.tier.lock:
+                self.tier.misses += 1
+            return default
+        with self.tier.lock:
+            self.tier.shared_hits += 1
+        self.set_local(local_key, value)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version)
+        self.set_local(self.make_key(key, version), value, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        with self.tier.lock:
+            self.discard_local(self.make_key(key, version))
+        return self.shared.delete(key, version)
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remaining = []
+        for key in keys:
+            value = self.get_local(self.make_key(key, version))
+            if value is MISSING:
+                remaining.append(key)
+            else:
+                found[key] = value
+        if remaining:
+            shared = self.shared.get_many(remaining, version)
+            with self.tier.lock:
+                self.tier.shared_hits += len(shared)
+                self.tier.misses += len(remaining) - len(shared)
+            for key, value in shared.items():
+                self.set_local(self.make_key(key, version), value)
+            found.update(shared)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version)
+        for key, value in data.items():
+            if key not in failed:
+                self.set_local(self.make_key(key, version), value, timeout)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        with self.tier.lock:
+            for key in keys:
+                self.discard_local(self.make_key(key, version))
+        self.shared.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return self.get_local(self.make_key(key, version)) is not MISSING or self.shared.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self.tier.lock:
+            self.discard_local(self.make_key(key, version))
+        return self.shared.incr(key, delta, version)
+
+    def clear(self):
+        with self.tier.lock:
+            self.tier.local.clear()
+            self.tier.size = 0
+        self.shared.clear()
+
+
+def memoize(timeout, key, hard_timeout=None):
+    """
+    Caches a function's results in the default cache under `key(*args)`.
+
+    Results are fresh for `timeout` seconds. Until `hard_timeout`
+    (settings.CACHE_HARD_TIMEOUT_IN_SECONDS by default) they are still returned
+    straight away while one background thread calls the function again.
+    After that callers wait for a new result, one call at a time per key.
+    Results are kept for CACHE_STALE_TIMEOUT_IN_SECONDS past the hard timeout
+    and served if calling the function fails because TMDB is unavailable.
+    """
+    return lambda func: Memoized(func, timeout, key, hard_timeout)
+
+
+class Memoized:
+    def __init__(self, func, timeout, key, hard_timeout=None):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.timeout = timeout
+        self.hard_timeout = max(hard_timeout or settings.CACHE_HARD_TIMEOUT_IN_SECONDS, timeout)
+        self.key = key
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.afunc = None
+        # Event loop -> key -> task refreshing it.
+        self.tasks = weakref.WeakKeyDictionary()
+
+    @property
+    def cache_timeout(self):
+        return self.hard_timeout + settings.CACHE_STALE_TIMEOUT_IN_SECONDS
+
+    def entry(self, value):
+        return (value, time.time())
+
+    def is_fresh(self, entry):
+        return time.time() - entry[1] < self.timeout
+
+    def is_usable(self, entry):
+        return entry is not None and time.time() - entry[1] < self.hard_timeout
+
+    def refresh(self, args, entry=None):
+        """
+        Returns a new (value, stored_at) entry from calling the function,
+        or the stale `entry` if that failed because TMDB is unavailable.
+        """
+        try:
+            return self.entry(self.func(*args))
+        except Exception as exc:
+            if entry is None or not is_transient(exc):
+                raise
+            logger.warning(f'Serving stale {self.__name__}{args!r}: {exc!r}')
+            return entry
+
+    def coalesced_refresh(self, key, args, entry=None, store=True):
+        """
+        refresh() shared by every thread asking for `key` at the same time,
+        so only one of them calls the function.
+        """
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            refreshed = self.refresh(args, entry)
+            if store and refreshed is not entry:
+                caches['default'].set(key, refreshed, self.cache_timeout)
+            future.set_result(refreshed)
+            return refreshed
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def revalidate(self, key, args, entry):
+        """
+        Refreshes `key` on a background thread,
+        unless this or another process is already doing so.
+        """
+        if key in self.in_flight:
+            return
+        if not caches['default'].add(f'{key}:revalidating', True, REVALIDATION_LOCK_TIMEOUT):
+            return
+        revalidation_executor.submit(self.background_refresh, key, args, entry)
+
+    def background_refresh(self, key, args, entry):
+        try:
+            self.coalesced_refresh(key, args, entry)
+        except Exception:
+            logger.exception(f'Failed to revalidate {self.__name__}{args!r}')
+        finally:
+            caches['default'].delete(f'{key}:revalidating')
+
+    def get(self, key, args, entry):
+        """
+        Returns the result given what's cached under `key`, which may be None,
+        revalidating or refreshing it as it ages.
+        """
+        if self.is_usable(entry):
+            if not self.is_fresh(entry):
+                self.revalidate(key, args, entry)
+            return entry[0]
+        return self.coalesced_refresh(key, args, entry)[0]
+
+    def __call__(self, *args):
+        key = self.key(*args)
+        return self.get(key, args, caches['default'].get(key))
+
+    def coroutine(self, afunc):
+        """
+        Decorates a coroutine function computing the same results,
+        returning a memoized coroutine function sharing this cache.
+        Django's cache backends are all sync, so it's used from worker threads.
+        """
+        self.afunc = afunc
+
+        @functools.wraps(afunc)
+        async def memoized(*args):
+            return await self.acall(*args)
+        return memoized
+
+    async def arefresh(self, args, entry=None):
+        try:
+            return self.entry(await self.afunc(*args))
+        except Exception as exc:
+            if entry is None or not is_transient(exc):
+                raise
+            logger.warning(f'Serving stale {self.__name__}{args!r}: {exc!r}')
+            return entry
+
+    async def arefresh_and_store(self, key, args, entry=None):
+        refreshed = await self.arefresh(args, entry)
+        if refreshed is not entry:
+            await sync_to_async(caches['default'].set, thread_sensitive=False)(key, refreshed, self.cache_timeout)
+        return refreshed
+
+    async def acoalesced_refresh(self, key, args, entry=None):
+        """
+        arefresh() shared by every request for `key` on this event loop at the same time.
+        """
+        tasks = self.tasks.setdefault(asyncio.get_running_loop(), {})
+        task = tasks.get(key)
+        if task is None:
+            task = tasks[key] = asyncio.ensure_future(self.arefresh_and_store(key, args, entry))
+            task.add_done_callback(lambda _: tasks.pop(key, None))
+        # A request going away shouldn't cancel the others' refresh.
+        return await asyncio.shield(task)
+
+    async def acall(self, *args):
+        key = self.key(*args)
+        entry = await sync_to_async(caches['default'].get, thread_sensitive=False)(key)
+        if self.is_usable(entry):
+            if not self.is_fresh(entry):
+                await sync_to_async(self.revalidate, thread_sensitive=False)(key, args, entry)
+            return entry[0]
+        return (await self.acoalesced_refresh(key, args, entry))[0]
+
+    def warm(self, *args, ahead=0):
+        """
+        Calls the function again unless the cached result
+        stays fresh for at least `ahead` more seconds.
+        Returns (result, whether the function was called).
+        """
+        key = self.key(*args)
+        entry = caches['default'].get(key)
+        if entry is not None and time.time() + ahead - entry[1] < self.timeout:
+            return entry[0], False
+        return self.coalesced_refresh(key, args, entry)[0], True
+
+
+def call_many(calls):
+    """
+    Returns a dict of (memoized function, args) -> result for many calls,
+    reading the cache in one round trip.
+    Calls without a usable result are made concurrently and cached in one more.
+    """
+    keys = {(func, args): func.key(*args) for func, args in calls}
+    found = caches['default'].get_many(list(keys.values()))
+
+    results = {}
+    missing = []
+    for (func, args), key in keys.items():
+        entry = found.get(key)
+        if func.is_usable(entry):
+            results[func, args] = func.get(key, args, entry)
+        else:
+            missing.append((func, args))
+
+    if missing:
+        with ThreadPoolExecutor(settings.TMDB_MAX_CONNECTIONS) as executor:
+            refreshed = list(executor.map(
+                lambda call: call[0].coalesced_refresh(keys[call], call[1], found.get(keys[call]), store=False),
+                missing,
+            ))
+        prime_cache(
+            {call: entry[0] for call, entry in zip(missing, refreshed) if entry is not found.get(keys[call])},
+            background=False,
+        )
+        results.update((call, entry[0]) for call, entry in zip(missing, refreshed))
+    return results
+
+
+def prime_cache(results, background=None):
+    """
+    Caches a dict of (memoized function, args) -> result in one round trip,
+    as if each function had been called.
+    When `background` (or settings.CACHE_PRIME_IN_BACKGROUND) is set the write
+    happens on a background thread and this returns straight away.
+    """
+    if not results:
+        return
+    entries = {func.key(*args): func.entry(value) for (func, args), value in results.items()}
+    timeout = max(func.cache_timeout for func, _ in results)
+    if background is None:
+        background = settings.CACHE_PRIME_IN_BACKGROUND
+    if background:
+        priming_executor.submit(set_many, entries, timeout)
+    else:
+        caches['default'].set_many(entries, timeout)
+
+
+def set_many(entries, timeout):
+    try:
+        caches['default'].set_many(entries, timeout)
+    except Exception:
+        logger.exception('Failed to prime the cache')
@@ -0,0 +1,184 @@
+import atexit
+import logging
+import os
+import threading
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import connection
+
+from api.metrics import metrics_from_histogram
+from api.models import Solution, SolutionLengthCount
+
+logger = logging.getLogger(__name__)
+
+# Solutions this process has seen, so repeat submissions can skip the database.
+MAX_KNOWN_SOLUTIONS = 10000
+
+
+class SolutionCounterBuffer:
+    """
+    Write-behind counter for solution submissions.
+
+    The first submission of a path in a process goes straight to the database
+    so it gets a token. Later submissions of the same path only bump an in-memory
+    counter, which a background thread writes out every `interval` seconds in
+    one statement. Counters are per process, so reads only see this process's
+    unwritten submissions. The buffer is drained when the process exits.
+    Solutions found deleted or moved to another puzzle when flushing are forgotten,
+    dropping their submissions since the last flush.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.known = OrderedDict()
+        self.pending = defaultdict(int)
+        self.pid = None
+        self.stopped = threading.Event()
+
+    def submit(self, puzzle, solution):
+        key = (puzzle.id, tuple(solution))
+        with self.lock:
+            known = self.known.get(key)
+            if known is not None:
+                self.known.move_to_end(key)
+                self.pending[known] += 1
+        if known is not None:
+            self.start()
+            pk, token, _, _ = known
+            submitted = Solution(id=pk, token=token, puzzle=puzzle, solution=list(solution))
+            submitted._state.adding = False
+            return submitted
+
+        submitted = Solution.submit(puzzle, solution)
+        if submitted is not None:
+            with self.lock:
+                self.known[key] = (submitted.id, submitted.token, puzzle.id, submitted.num_degrees)
+                while len(self.known) > MAX_KNOWN_SOLUTIONS:
+                    self.known.popitem(last=False)
+        return submitted
+
+    def pending_count(self, solution_id):
+        with self.lock:
+            return sum(count for (pk, _, _, _), count in self.pending.items() if pk == solution_id)
+
+    def pending_histogram(self, puzzle_id):
+        """
+        Returns steps -> submissions not yet written for a puzzle.
+        """
+        histogram = defaultdict(int)
+        with self.lock:
+            for (_, _, pending_puzzle_id, steps), count in self.pending.items():
+                if pending_puzzle_id == puzzle_id:
+                    histogram[steps] += count
+        return histogram
+
+    def start(self):
+        """
+        Starts the flushing thread, once per process since threads don't survive a fork.
+        """
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.stopped.clear()
+            threading.Thread(target=self.run, name='solution-counter-flush', daemon=True).start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+            connection.close()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(int)
+        if not pending:
+            return
+
+        ids = [pk for pk, _, _, _ in pending]
+        puzzle_ids = [puzzle_id for _, _, puzzle_id, _ in pending]
+        deltas = list(pending.values())
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    WITH deltas AS (
+                        SELECT * FROM unnest(%s::bigint[], %s::bigint[], %s::int[]) AS d(id, puzzle_id, delta)
+                    ), updated AS (
+                        UPDATE {Solution._meta.db_table} AS s
+                        SET count = s.count + deltas.delta, object_modified = NOW()
+                        FROM deltas
+                        WHERE s.id = deltas.id AND s.puzzle_id = deltas.puzzle_id
+                        RETURNING s.id, s.puzzle_id, CARDINALITY(s.solution) - 1 AS steps, deltas.delta
+                    ), counted AS (
+                        UPDATE {SolutionLengthCount._meta.db_table} AS h
+                        SET plays = h.plays + grouped.delta
+                        FROM (
+                            SELECT puzzle_id, steps, SUM(delta) AS delta
+                            FROM updated
+                            GROUP BY puzzle_id, steps
+                        ) AS grouped
+                        WHERE h.puzzle_id = grouped.puzzle_id AND h.steps = grouped.steps
+                    )
+                    SELECT id FROM updated
+                    """,
+                    [ids, puzzle_ids, deltas],
+                )
+                updated = {pk for pk, in cursor.fetchall()}
+        except Exception:
+            logger.exception('Failed to flush solution counts, will retry')
+            with self.lock:
+                for known, count in pending.items():
+                    self.pending[known] += count
+        else:
+            self.forget(set(ids) - updated)
+
+    def forget(self, solution_ids):
+        """
+        Forgets solutions, so their next submission goes to the database again.
+        """
+        if not solution_ids:
+            return
+        with self.lock:
+            for key, (pk, _, _, _) in list(self.known.items()):
+                if pk in solution_ids:
+                    del self.known[key]
+
+    def drain(self):
+        self.stopped.set()
+        self.flush()
+
+
+solution_counter = SolutionCounterBuffer(settings.SOLUTION_FLUSH_INTERVAL_IN_SECONDS)
+atexit.register(solution_counter.drain)
+
+
+def submit_solution(puzzle, solution):
+    """
+    Counts one submission of a solution, buffered if SOLUTION_WRITE_BEHIND is on.
+    """
+    if settings.SOLUTION_WRITE_BEHIND:
+        return solution_counter.submit(puzzle, solution)
+    return Solution.submit(puzzle, solution)
+
+
+def current_puzzle_metrics(puzzle):
+    """
+    PuzzleMetrics including submissions this process hasn't written yet.
+    """
+    pending = solution_counter.pending_histogram(puzzle.id)
+    if not pending:
+        return puzzle.metrics
+    histogram = [
+        (steps, plays + pending.pop(steps, 0), solutions)
+        for steps, plays, solutions in puzzle.length_histogram()
+    ]
+    histogram += [(steps, plays, 0) for steps, plays in pending.items()]
+    return metrics_from_histogram(sorted(histogram))
+
+
+def current_solution_count(solution):
+    return solution.count + solution_counter.pending_count(solution.id)
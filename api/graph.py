@@ -0,0 +1,496 @@
+import json
+import os
+import shutil
+import threading
+import time
+from array import array
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+# Cast credits have no job, they all share this one.
+CAST_JOB = 'Cast'
+
+# Edges are spilled to disk in batches of this many credits while building.
+EDGE_BATCH_SIZE = 100000
+
+# Versions of the store kept on disk, so processes still reading
+# an older version aren't left without files.
+VERSIONS_TO_KEEP = 2
+
+
+def map_raw(path, columns):
+    """
+    Returns a file of raw int32 rows memory-mapped, without reading it into memory.
+    """
+    if not os.path.getsize(path):
+        return np.zeros((0, columns), dtype=np.int32)
+    return np.memmap(path, dtype=np.int32, mode='r').reshape(-1, columns)
+
+
+def save_raw(source, target, dtype):
+    """
+    Turns a file of raw values into a .npy file without reading it into memory.
+    """
+    dtype = np.dtype(dtype)
+    header = {
+        'descr': np.lib.format.dtype_to_descr(dtype),
+        'fortran_order': False,
+        'shape': (os.path.getsize(source) // dtype.itemsize, ),
+    }
+    with open(source, 'rb') as raw, open(target, 'wb') as npy:
+        np.lib.format.write_array_header_1_0(npy, header)
+        shutil.copyfileobj(raw, npy)
+    os.remove(source)
+
+
+def lookup(ids, values):
+    """
+    Returns the index of each of `values` in the sorted `ids`, or -1 where it's missing.
+    """
+    if not len(ids):
+        return np.full(len(values), -1)
+    indexes = np.searchsorted(ids, values)
+    found = (indexes < len(ids)) & (ids[np.minimum(indexes, len(ids) - 1)] == values)
+    return np.where(found, indexes, -1)
+
+
+class NodeTable:
+    """
+    Films or people being collected by a GraphBuilder.
+    Display fields are appended to a file as JSON as soon as they arrive,
+    only ids, popularity and offsets are kept in memory.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.positions = {}
+        self.ids = array('i')
+        self.popularity = array('f')
+        self.refreshed = array('q')
+        self.offsets = array('q')
+        self.lengths = array('i')
+        self.meta = open(f'{prefix}_meta.tmp', 'wb')
+
+    def add(self, node_id, meta, popularity=None, refreshed=None):
+        """
+        Adds a node or updates one that was added before.
+        `popularity` and `refreshed` are left as they were when None.
+        """
+        encoded = json.dumps(meta, separators=(',', ':')).encode()
+        position = self.positions.get(node_id)
+        if position is None:
+            position = self.positions[node_id] = len(self.ids)
+            self.ids.append(node_id)
+            self.popularity.append(0)
+            self.refreshed.append(0)
+            self.offsets.append(0)
+            self.lengths.append(0)
+        if popularity is not None:
+            self.popularity[position] = popularity
+        if refreshed is not None:
+            self.refreshed[position] = refreshed
+        self.offsets[position] = self.meta.tell()
+        self.lengths[position] = len(encoded)
+        self.meta.write(encoded)
+
+    def mark_refreshed(self, node_id, refreshed):
+        """
+        Records when a node added before had its credits loaded in full.
+        """
+        position = self.positions.get(node_id)
+        if position is not None:
+            self.refreshed[position] = refreshed
+
+    def write(self, directory, name):
+        """
+        Writes the nodes ordered by id, returning the sorted ids and popularity.
+        """
+        self.meta.close()
+        order = np.argsort(np.frombuffer(self.ids, dtype=np.int32), kind='stable')
+        ids = np.frombuffer(self.ids, dtype=np.int32)[order]
+        popularity = np.frombuffer(self.popularity, dtype=np.float32)[order]
+        refreshed = np.frombuffer(self.refreshed, dtype=np.int64)[order]
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)[order]
+        lengths = np.frombuffer(self.lengths, dtype=np.int32)[order]
+
+        # Rewrite the display fields in id order, dropping superseded records.
+        meta_offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=meta_offsets[1:])
+        with open(f'{self.prefix}_meta.tmp', 'rb') as source, open(directory / f'{name}_meta.bin', 'wb') as target:
+            for offset, length in zip(offsets.tolist(), lengths.tolist()):
+                source.seek(offset)
+                target.write(source.read(length))
+        os.remove(f'{self.prefix}_meta.tmp')
+
+        np.save(directory / f'{name}_ids.npy', ids)
+        np.save(directory / f'{name}_popularity.npy', popularity)
+        np.save(directory / f'{name}_refreshed.npy', refreshed)
+        np.save(directory / f'{name}_meta_offsets.npy', meta_offsets)
+        return ids, popularity
+
+
+class GraphBuilder:
+    """
+    Collects films, people and the credits between them, then writes
+    them out as a new version of the graph store with `build`.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or settings.GRAPH_STORE_PATH)
+        self.version = str(time.time_ns())
+        self.directory = self.path / self.version
+        self.directory.mkdir(parents=True)
+        self.movies = NodeTable(self.directory / 'movie')
+        self.persons = NodeTable(self.directory / 'person')
+        self.jobs = {CAST_JOB: 0}
+        self.edges = array('i')
+        self.edges_file = open(self.directory / 'edges.tmp', 'wb')
+
+    def job_code(self, job):
+        return self.jobs.setdefault(job or CAST_JOB, len(self.jobs))
+
+    def add_movie(self, movie, refreshed=None):
+        self.movies.add(
+            movie['id'],
+            {'title': movie.get('title'), 'poster_path': movie.get('poster_path'), 'id': movie['id']},
+            popularity=movie.get('popularity'),
+            refreshed=refreshed,
+        )
+
+    def add_person(self, person, refreshed=None):
+        self.persons.add(
+            person['id'],
+            {'name': person.get('name'), 'profile_path': person.get('profile_path'), 'id': person['id']},
+            popularity=person.get('popularity'),
+            refreshed=refreshed,
+        )
+
+    def mark_movie_refreshed(self, movie_id, refreshed):
+        self.movies.mark_refreshed(movie_id, refreshed)
+
+    def add_credit(self, movie_id, person_id, job=None):
+        self.edges.extend((movie_id, person_id, self.job_code(job)))
+        if len(self.edges) >= EDGE_BATCH_SIZE * 3:
+            self.flush_edges()
+
+    def add_movie_credits(self, movie, credits, refreshed=None):
+        """
+        Adds a film and everyone in its TMDB credits.
+        """
+        self.add_movie(movie, refreshed=refreshed or int(time.time()))
+        for person in credits.get('cast', []) + credits.get('crew', []):
+            self.add_person(person)
+            self.add_credit(movie['id'], person['id'], person.get('job'))
+
+    def add_person_credits(self, person, credits, refreshed=None):
+        """
+        Adds a person and every film in their TMDB movie credits.
+        """
+        self.add_person(person, refreshed=refreshed or int(time.time()))
+        for movie in credits.get('cast', []) + credits.get('crew', []):
+            self.add_movie(movie)
+            self.add_credit(movie['id'], person['id'], movie.get('job'))
+
+    def copy_from(self, graph, skip_movie_ids=(), skip_person_ids=()):
+        """
+        Adds everything in an existing store, except the credits of
+        the films and people that are about to be refreshed.
+        """
+        for table, node_ids, popularity, refreshed, name in (
+            (self.movies, graph.movie_ids, graph.movie_popularity, graph.movie_refreshed, 'movie'),
+            (self.persons, graph.person_ids, graph.person_popularity, graph.person_refreshed, 'person'),
+        ):
+            for index, node_id in enumerate(node_ids.tolist()):
+                table.add(
+                    node_id,
+                    graph.meta(name, index),
+                    popularity=float(popularity[index]),
+                    refreshed=int(refreshed[index]),
+                )
+
+        codes = np.array([self.job_code(job) for job in graph.jobs], dtype=np.int32)
+        skip_movie_ids = np.array(list(skip_movie_ids), dtype=np.int32)
+        skip_person_ids = np.array(list(skip_person_ids), dtype=np.int32)
+        self.flush_edges()
+        for start in range(0, len(graph.movie_edges), EDGE_BATCH_SIZE):
+            end = min(start + EDGE_BATCH_SIZE, len(graph.movie_edges))
+            rows = np.searchsorted(graph.movie_indptr, np.arange(start, end), side='right') - 1
+            movies = graph.movie_ids[rows]
+            persons = graph.person_ids[graph.movie_edges[start:end]]
+            keep = ~np.isin(movies, skip_movie_ids) & ~np.isin(persons, skip_person_ids)
+            np.stack(
+                (movies[keep], persons[keep], codes[graph.movie_edge_jobs[start:end][keep]]),
+                axis=1,
+            ).astype(np.int32).tofile(self.edges_file)
+
+    def flush_edges(self):
+        self.edges.tofile(self.edges_file)
+        del self.edges[:]
+
+    def build(self):
+        """
+        Writes the CSR adjacency arrays for both directions,
+        makes this version current and returns it as a GraphStore.
+        """
+        self.flush_edges()
+        self.edges_file.close()
+        movie_ids, movie_popularity = self.movies.write(self.directory, 'movie')
+        person_ids, person_popularity = self.persons.write(self.directory, 'person')
+
+        self.index_edges(movie_ids, person_ids)
+        self.write_adjacency('movie', 0, 1, person_popularity, len(movie_ids))
+        self.write_adjacency('person', 1, 0, movie_popularity, len(person_ids))
+        os.remove(self.directory / 'indexed.tmp')
+
+        jobs_by_code = sorted(self.jobs, key=self.jobs.get)
+        with open(self.directory / 'manifest.json', 'w') as manifest:
+            json.dump({'version': self.version, 'jobs': jobs_by_code}, manifest)
+
+        current = self.path / 'CURRENT'
+        with open(self.path / 'CURRENT.tmp', 'w') as pointer:
+            pointer.write(self.version)
+        os.replace(self.path / 'CURRENT.tmp', current)
+        self.remove_old_versions()
+        return GraphStore(self.directory)
+
+    def index_edges(self, movie_ids, person_ids):
+        """
+        Rewrites the spilled credits as (film index, person index, job) a batch at a time,
+        dropping credits for films or people that were never added.
+        """
+        edges = map_raw(self.directory / 'edges.tmp', 3)
+        with open(self.directory / 'indexed.tmp', 'wb') as indexed:
+            for start in range(0, len(edges), EDGE_BATCH_SIZE):
+                batch = np.array(edges[start:start + EDGE_BATCH_SIZE])
+                movies = lookup(movie_ids, batch[:, 0])
+                persons = lookup(person_ids, batch[:, 1])
+                known = (movies >= 0) & (persons >= 0)
+                np.stack((movies[known], persons[known], batch[known, 2]), axis=1).astype(np.int32).tofile(indexed)
+        del edges
+        os.remove(self.directory / 'edges.tmp')
+
+    def write_adjacency(self, name, row_field, column_field, column_popularity, size):
+        """
+        Writes the CSR arrays with the indexed credits as rows of `row_field`.
+        Credits are bucketed by row into a scratch file, then each run of rows
+        is read back, ordered by popularity, most popular first, and deduplicated,
+        so only a batch of credits is in memory at a time.
+        """
+        edges = map_raw(self.directory / 'indexed.tmp', 3)
+        counts = np.zeros(size, dtype=np.int64)
+        for start in range(0, len(edges), EDGE_BATCH_SIZE):
+            rows, row_counts = np.unique(edges[start:start + EDGE_BATCH_SIZE, row_field], return_counts=True)
+            counts[rows] += row_counts
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+
+        bucketed_path = self.directory / f'{name}_bucketed.tmp'
+        if len(edges):
+            bucketed = np.memmap(bucketed_path, dtype=np.int32, mode='w+', shape=(len(edges), 2))
+        else:
+            bucketed = np.zeros((0, 2), dtype=np.int32)
+        cursors = indptr[:-1].copy()
+        for start in range(0, len(edges), EDGE_BATCH_SIZE):
+            batch = np.array(edges[start:start + EDGE_BATCH_SIZE])
+            order = np.argsort(batch[:, row_field], kind='stable')
+            batch = batch[order]
+            rows = batch[:, row_field]
+            # Each credit goes after those already placed in its row.
+            positions = cursors[rows] + np.arange(len(rows)) - np.searchsorted(rows, rows)
+            bucketed[positions, 0] = batch[:, column_field]
+            bucketed[positions, 1] = batch[:, 2]
+            rows, row_counts = np.unique(rows, return_counts=True)
+            cursors[rows] += row_counts
+        del edges
+
+        counts[:] = 0
+        with open(self.directory / f'{name}_edges.tmp', 'wb') as columns_file, \
+                open(self.directory / f'{name}_edge_jobs.tmp', 'wb') as jobs_file:
+            row = 0
+            while row < size:
+                # As many whole rows as fit in a batch, and at least one.
+                end = int(np.searchsorted(indptr, indptr[row] + EDGE_BATCH_SIZE, side='right')) - 1
+                end = min(max(end, row + 1), size)
+                block = np.array(bucketed[indptr[row]:indptr[end]])
+                rows = np.repeat(np.arange(row, end), np.diff(indptr[row:end + 1]))
+                columns, jobs = block[:, 0], block[:, 1]
+                order = np.lexsort((jobs, columns, -column_popularity[columns], rows))
+                rows, columns, jobs = rows[order], columns[order], jobs[order]
+                keep = np.ones(len(rows), dtype=bool)
+                keep[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1]) | (jobs[1:] != jobs[:-1])
+                columns[keep].astype(np.int32).tofile(columns_file)
+                jobs[keep].astype(np.int16).tofile(jobs_file)
+                counts[row:end] = np.bincount(rows[keep] - row, minlength=end - row)
+                row = end
+        del bucketed
+        if bucketed_path.exists():
+            os.remove(bucketed_path)
+
+        np.cumsum(counts, out=indptr[1:])
+        np.save(self.directory / f'{name}_indptr.npy', indptr)
+        save_raw(self.directory / f'{name}_edges.tmp', self.directory / f'{name}_edges.npy', np.int32)
+        save_raw(self.directory / f'{name}_edge_jobs.tmp', self.directory / f'{name}_edge_jobs.npy', np.int16)
+
+    def remove_old_versions(self):
+        versions = sorted(
+            (child for child in self.path.iterdir() if child.is_dir() and child.name.isdigit()),
+            key=lambda child: int(child.name),
+        )
+        for child in versions[:-VERSIONS_TO_KEEP]:
+            shutil.rmtree(child, ignore_errors=True)
+
+
+class GraphStore:
+    """
+    Read-only, memory-mapped bipartite graph of films and people.
+    Adjacency is stored CSR-style: the neighbours of the film at index `i`
+    are `movie_edges[movie_indptr[i]:movie_indptr[i + 1]]`, and likewise for people.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / 'manifest.json') as manifest:
+            manifest = json.load(manifest)
+        self.version = manifest['version']
+        self.jobs = manifest['jobs']
+        self.codes = {}
+
+        for name in ('movie', 'person'):
+            for array_name in ('ids', 'popularity', 'refreshed', 'meta_offsets', 'indptr', 'edges', 'edge_jobs'):
+                setattr(
+                    self,
+                    f'{name}_{array_name}',
+                    np.load(self.directory / f'{name}_{array_name}.npy', mmap_mode='r'),
+                )
+            meta_path = self.directory / f'{name}_meta.bin'
+            setattr(
+                self,
+                f'{name}_meta',
+                np.memmap(meta_path, dtype=np.uint8, mode='r') if os.path.getsize(meta_path) else np.zeros(0, dtype=np.uint8),
+            )
+
+    def job_codes(self, jobs):
+        jobs = frozenset(jobs)
+        if jobs not in self.codes:
+            self.codes[jobs] = np.array(
+                [code for code, job in enumerate(self.jobs) if job in jobs], dtype=np.int16
+            )
+        return self.codes[jobs]
+
+    def index(self, name, node_id):
+        ids = getattr(self, f'{name}_ids')
+        index = int(np.searchsorted(ids, node_id))
+        if index < len(ids) and ids[index] == node_id:
+            return index
+
+    def meta(self, name, index):
+        offsets = getattr(self, f'{name}_meta_offsets')
+        blob = getattr(self, f'{name}_meta')
+        return json.loads(bytes(blob[offsets[index]:offsets[index + 1]]))
+
+    def is_fresh(self, name, node_id, max_age=None):
+        """
+        Whether the node's credits were loaded in full within `max_age` seconds.
+        """
+        index = self.index(name, node_id)
+        if index is None:
+            return False
+        if max_age is None:
+            max_age = settings.GRAPH_STALE_AFTER_IN_SECONDS
+        refreshed = int(getattr(self, f'{name}_refreshed')[index])
+        return refreshed > 0 and time.time() - refreshed < max_age
+
+    def neighbours(self, name, node_id):
+        """
+        Returns the ids, popularity and job codes of a node's neighbours,
+        most popular first, or None if the node's credits are missing or stale.
+        """
+        if not self.is_fresh(name, node_id):
+            return None
+        index = self.index(name, node_id)
+        other = 'person' if name == 'movie' else 'movie'
+        indptr = getattr(self, f'{name}_indptr')
+        columns = getattr(self, f'{name}_edges')[indptr[index]:indptr[index + 1]]
+        return (
+            getattr(self, f'{other}_ids')[columns],
+            getattr(self, f'{other}_popularity')[columns],
+            getattr(self, f'{name}_edge_jobs')[indptr[index]:indptr[index + 1]],
+        )
+
+    def has_credit(self, movie_id, person_id):
+        """
+        Whether a person is credited on a film, however old the credits.
+        """
+        movie = self.index('movie', movie_id)
+        person = self.index('person', person_id)
+        if movie is None or person is None:
+            return False
+        return bool((self.movie_edges[self.movie_indptr[movie]:self.movie_indptr[movie + 1]] == person).any())
+
+    def movie_neighbours(self, movie_id):
+        return self.neighbours('movie', movie_id)
+
+    def person_neighbours(self, person_id):
+        return self.neighbours('person', person_id)
+
+    def stale_ids(self, name, max_age=None):
+        """
+        Returns the ids of nodes whose credits were loaded in full
+        but more than `max_age` seconds ago.
+        """
+        if max_age is None:
+            max_age = settings.GRAPH_STALE_AFTER_IN_SECONDS
+        refreshed = getattr(self, f'{name}_refreshed')
+        stale = (refreshed > 0) & (refreshed < time.time() - max_age)
+        return getattr(self, f'{name}_ids')[stale]
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_graph():
+    """
+    Returns the current GraphStore, or None if one hasn't been built.
+    The store is reopened when a new version is built.
+    """
+    global _graph
+    path = Path(settings.GRAPH_STORE_PATH)
+    try:
+        with open(path / 'CURRENT') as pointer:
+            version = pointer.read().strip()
+    except OSError:
+        return None
+
+    if _graph is None or _graph.version != version:
+        with _graph_lock:
+            if _graph is None or _graph.version != version:
+                _graph = GraphStore(path / version)
+    return _graph
+
+
+def refresh_stale_nodes(fetch_movie_credits, fetch_person_credits, max_age=None, limit=None):
+    """
+    Rebuilds the store with fresh credits for the films and people that have gone stale.
+    `fetch_movie_credits` and `fetch_person_credits` take an id and return TMDB credits.
+    Returns the new GraphStore and the number of nodes refreshed.
+    """
+    graph = get_graph()
+    if graph is None:
+        return None, 0
+
+    movie_ids = graph.stale_ids('movie', max_age)[:limit].tolist()
+    person_ids = graph.stale_ids('person', max_age)[:limit].tolist()
+    builder = GraphBuilder(graph.directory.parent)
+    builder.copy_from(graph, skip_movie_ids=movie_ids, skip_person_ids=person_ids)
+    for movie_id in movie_ids:
+        movie = dict(graph.meta('movie', graph.index('movie', movie_id)))
+        movie['popularity'] = float(graph.movie_popularity[graph.index('movie', movie_id)])
+        builder.add_movie_credits(movie, fetch_movie_credits(movie_id))
+    for person_id in person_ids:
+        person = dict(graph.meta('person', graph.index('person', person_id)))
+        person['popularity'] = float(graph.person_popularity[graph.index('person', person_id)])
+        builder.add_person_credits(person, fetch_person_credits(person_id))
+    return builder.build(), len(movie_ids) + len(person_ids)
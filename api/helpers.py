@@ -1,13 +1,19 @@
 import gc
 import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-import tmdbsimple as tmdb
+import numpy as np
 from django.conf import settings
 
+from api.graph import CAST_JOB, get_graph
 from api.models import Puzzle, Solution
+from api.tmdb_client import get_client
 from api.utils import (
-    get_movie_cast_and_crew,
+    get_movie_credit_ids,
     get_movie_info,
+    get_person_credit_ids,
     get_persons_filmography,
     get_persons_info,
     order_by_popularity_and_deduplicate,
@@ -22,29 +28,25 @@ def random_filmography_six_steps_away(movie_id):
 
     # Execute three pairs of steps: cast/crew followed by film
     for i in range(3):
-        cast_and_crew = get_movie_cast_and_crew(movie_id)
-        cast_and_crew_ids = {person['id'] for person in cast_and_crew}
+        cast_and_crew_ids = get_movie_credit_ids(movie_id)
         # Choose a branch randomly that hasn't previously been followed
-        person_id = random.choice(list(cast_and_crew_ids - previous_person_ids))
+        person_id = random.choice([id for id in cast_and_crew_ids if id not in previous_person_ids])
         # Don't randomly go backwards later
         previous_person_ids.add(person_id)
-        person = [person for person in cast_and_crew if person['id'] == person_id][0]
-        print(person['name'], end=' | ')
+        print(get_persons_info(person_id)['name'], end=' | ')
 
-        filmography = get_persons_filmography(person_id)
         # Don't bother with movie steps on last iteration
         if i < 2:
-            movie_ids = {movie['id'] for movie in filmography}
+            movie_ids = get_person_credit_ids(person_id)
             # Choose a branch randomly that hasn't previously been followed
-            movie_id = random.choice(list(movie_ids - previous_movie_ids))
+            movie_id = random.choice([id for id in movie_ids if id not in previous_movie_ids])
             # Don't randomly go backwards later
             previous_movie_ids.add(movie_id)
-            movie = [movie for movie in filmography if movie['id'] == movie_id][0]
-            print(movie['title'], end=' | ')
+            print(get_movie_info(movie_id)['title'], end=' | ')
     
     print()
-    # The final value of `filmography` is a set of "end movies" six steps away from our start movie.
-    for film in filmography[:25]:
+    # The filmography of the last person is a set of "end movies" six steps away from our start movie.
+    for film in get_persons_filmography(person_id)[:25]:
         print(f'{film["id"]}: {film["title"]}')
 
 
@@ -85,6 +87,37 @@ safe_jobs = {
     'Characters',
 }
 
+# People and films at or below these popularities are not useful in building solutions.
+# These thresholds are arbitrary.
+MIN_PERSON_POPULARITY = 1.5
+MIN_FILM_POPULARITY = 5
+
+
+def person_neighbours(person_id):
+    """
+    Returns the films in a person's filmography that are useful
+    in building solutions, ordered by popularity.
+    """
+    filmography = get_client().person_movie_credits(person_id)
+    as_cast = filmography['cast']
+    as_crew = filmography['crew']
+    # Exclude some stuff that no one has ever seen.
+    filmography = [movie for movie in as_cast + as_crew if movie.get('popularity', 0) > MIN_FILM_POPULARITY]
+    return order_by_popularity_and_deduplicate(filmography)
+
+
+def film_neighbours(movie_id):
+    """
+    Returns the people credited on a film that are useful
+    in building solutions.
+    """
+    credits = get_client().movie_credits(movie_id)
+    cast = credits['cast']
+    # Exclude roles no one knows about.
+    crew = [credit for credit in credits['crew'] if credit['job'] in safe_jobs]
+    # Exclude unpopular people.
+    return [person for person in cast + crew if person.get('popularity', 0) > MIN_PERSON_POPULARITY]
+
 
 class Node:    
     class Type:
@@ -138,6 +171,13 @@ class Node:
             return 0
         return self.parent.get_depth() + 1
 
+    @property
+    def key(self):
+        """
+        The (type, id) pair identifying this node in a search.
+        """
+        return (self.type, self.node_id)
+
 class PersonNode(Node):
     def __init__(self, node_id, name=None, parent=None):
         if not name:
@@ -146,14 +186,7 @@ class PersonNode(Node):
         self.type = Node.Type.PERSON
 
     def make_request(self):
-        tmdb.API_KEY = settings.TMDB_API_KEY
-        person = tmdb.People(self.node_id)
-        filmography = person.movie_credits()
-        as_cast = filmography['cast']
-        as_crew = filmography['crew']
-        # Exclude some stuff that no one has ever seen.
-        filmography = [movie for movie in as_cast + as_crew if movie.get('popularity', 0) > 5]
-        return order_by_popularity_and_deduplicate(filmography)
+        return person_neighbours(self.node_id)
         
     def populate_children(self):
         self.children = {FilmNode(c['id'], c['title'], self) for c in self.make_request()}
@@ -166,43 +199,272 @@ class FilmNode(Node):
         self.type = Node.Type.FILM
 
     def make_request(self):
-        tmdb.API_KEY = settings.TMDB_API_KEY
-        movie = tmdb.Movies(self.node_id)
-        credits = movie.credits()
-        cast = credits['cast']
-        # Exclude roles no one knows about.
-        crew = [credit for credit in credits['crew'] if credit['job'] in safe_jobs]
-        # Exclude unpopular people, this threshold is arbitrary.
-        return [person for person in cast + crew if person.get('popularity', 0) > 1.5]
+        return film_neighbours(self.node_id)
 
     def populate_children(self):
         self.children = {PersonNode(c['id'], c['name'], self) for c in self.make_request()}
 
-def find_shortest_solution(start, end, max_depth=6, save_to_db=False):
+def expand(key, graph):
+    """
+    Returns the keys of the nodes one step away from the node with `key`.
+    Films lead to people and people lead to films.
+    Neighbours are read from the local graph store `graph` when it has them,
+    otherwise they are requested from TMDB.
+    """
+    node_type, node_id = key
+    if node_type == Node.Type.FILM:
+        neighbours = graph.movie_neighbours(node_id) if graph else None
+        if neighbours is None:
+            return [(Node.Type.PERSON, c['id']) for c in film_neighbours(node_id)]
+        ids, popularity, jobs = neighbours
+        useful = (popularity > MIN_PERSON_POPULARITY) & np.isin(jobs, graph.job_codes(safe_jobs | {CAST_JOB}))
+        return [(Node.Type.PERSON, person_id) for person_id in dict.fromkeys(ids[useful].tolist())]
+
+    neighbours = graph.person_neighbours(node_id) if graph else None
+    if neighbours is None:
+        return [(Node.Type.FILM, c['id']) for c in person_neighbours(node_id)]
+    ids, popularity, _ = neighbours
+    useful = popularity > MIN_FILM_POPULARITY
+    return [(Node.Type.FILM, movie_id) for movie_id in dict.fromkeys(ids[useful].tolist())]
+
+
+def expand_level(keys):
+    """
+    Expands every node in a BFS level, returning a dict of key -> neighbour keys.
+    """
+    graph = get_graph()
+    return {key: expand(key, graph) for key in keys}
+
+
+class ConcurrentExpander:
+    """
+    Expands a whole BFS level at once on a bounded pool of threads.
+    At most `max_connections` requests are made to TMDB at a time, and
+    nodes requested while a request for them is already in flight
+    share that request. Each node is expanded by `expand`.
+    With `remember`, every result is kept until the expander is shut down,
+    so the searches sharing it never expand a node twice.
+    """
+
+    def __init__(self, max_workers=None, max_connections=None, expand=expand, remember=False):
+        self.expand = expand
+        self.remember = remember
+        self.executor = ThreadPoolExecutor(max_workers or settings.SOLVER_MAX_WORKERS)
+        self.connections = threading.BoundedSemaphore(
+            max_connections or settings.TMDB_MAX_CONNECTIONS
+        )
+        # Key -> future of its neighbours, while in flight or, with `remember`, done.
+        self.futures = {}
+        self.lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def __call__(self, keys):
+        graph = get_graph()
+        futures = {key: self.submit(key, graph) for key in keys}
+        return {key: future.result() for key, future in futures.items()}
+
+    def submit(self, key, graph):
+        with self.lock:
+            future = self.futures.get(key)
+            # A failure may not have been forgotten yet when its callers wake up.
+            if future is None or (future.done() and future.exception() is not None):
+                future = self.executor.submit(self.fetch, key, graph)
+                self.futures[key] = future
+                future.add_done_callback(lambda done: self.forget(key, done))
+        return future
+
+    def forget(self, key, future):
+        # Failures are always forgotten, so the next search tries again.
+        if self.remember and future.exception() is None:
+            return
+        with self.lock:
+            if self.futures.get(key) is future:
+                del self.futures[key]
+
+    def fetch(self, key, graph):
+        with self.connections:
+            return self.expand(key, graph)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class SearchSide:
+    """
+    One half of a bidirectional search: the nodes reached from a single root.
+    """
+
+    def __init__(self, root):
+        self.parents = {root: None}
+        # Every node one step closer to the root, not just the first found.
+        self.predecessors = {root: []}
+        self.depths = {root: 0}
+        # Number of shortest paths from the root to each node.
+        self.paths = {root: 1}
+        self.frontier = deque([root])
+        self.depth = 0
+
+    def path_to_root(self, key):
+        path = []
+        while key is not None:
+            path.append(key)
+            key = self.parents[key]
+        return path
+
+    def sample_path_to_root(self, key, rng=random):
+        """
+        Returns one of the shortest paths from `key` to the root, each equally likely,
+        by stepping to each predecessor in proportion to its number of paths.
+        """
+        path = [key]
+        while self.predecessors[key]:
+            predecessors = self.predecessors[key]
+            key = rng.choices(predecessors, [self.paths[predecessor] for predecessor in predecessors])[0]
+            path.append(key)
+        return path
+
+
+class BidirectionalSearch:
+    """
+    Level-synchronous breadth-first search which grows one frontier from
+    the start and one from the end, always expanding the smaller one,
+    and stops at the first level where they meet.
+
+    Each side also counts the shortest paths from its root to every node
+    it reaches, so once they meet the number of shortest paths between
+    start and end is a sum over the meeting level, without listing them.
+    """
+
+    def __init__(self, start, end, max_depth=6, expand_level=expand_level):
+        self.start = start
+        self.end = end
+        self.max_depth = max_depth
+        self.expand_level = expand_level
+        self.expansions = 0
+        self.num_shortest_paths = 0
+        # (node, number of shortest paths through it) on the level where the sides met.
+        self.meetings = []
+
+    def run(self):
+        """
+        Returns the list of node keys on a shortest path from start to end,
+        or None if there isn't one within `max_depth` steps.
+        """
+        forward = self.forward = SearchSide(self.start)
+        backward = self.backward = SearchSide(self.end)
+
+        if self.start == self.end:
+            self.num_shortest_paths = 1
+            self.meetings = [(self.start, 1)]
+            return [self.start]
+
+        # Every meeting found while expanding a level is at most
+        # forward.depth + backward.depth steps long, so stopping here
+        # keeps the depth limit exact.
+        while forward.frontier and backward.frontier and forward.depth + backward.depth < self.max_depth:
+            if len(forward.frontier) <= len(backward.frontier):
+                meeting = self.advance(forward, backward)
+            else:
+                meeting = self.advance(backward, forward)
+            if meeting is not None:
+                return forward.path_to_root(meeting)[::-1] + backward.path_to_root(meeting)[1:]
+        return None
+
+    def advance(self, side, other):
+        """
+        Expands the whole frontier of `side` by one level.
+        Returns the node where the two sides meet on the shortest path, if any.
+        """
+        level = list(side.frontier)
+        side.frontier.clear()
+        side.depth += 1
+        neighbours = self.expand_level(level)
+        self.expansions += len(level)
+
+        meeting, shortest = None, None
+        for key in level:
+            for child in dict.fromkeys(neighbours.get(key, ())):
+                depth = side.depths.get(child)
+                if depth == side.depth:
+                    # Another shortest way to a node already found on this level.
+                    side.predecessors[child].append(key)
+                    side.paths[child] += side.paths[key]
+                if depth is not None:
+                    continue
+                side.parents[child] = key
+                side.predecessors[child] = [key]
+                side.depths[child] = side.depth
+                side.paths[child] = side.paths[key]
+                side.frontier.append(child)
+                if child in other.depths:
+                    length = side.depth + other.depths[child]
+                    if shortest is None or length < shortest:
+                        meeting, shortest = child, length
+
+        if meeting is not None:
+            # Every shortest path crosses this level exactly once.
+            self.meetings = [
+                (key, side.paths[key] * other.paths[key])
+                for key in side.frontier
+                if other.depths.get(key) == shortest - side.depth
+            ]
+            self.num_shortest_paths = sum(count for _, count in self.meetings)
+        return meeting
+
+    def sample_paths(self, count, rng=random):
+        """
+        Returns up to `count` different shortest paths from start to end,
+        each drawn uniformly at random from all of them, once run() found any.
+        """
+        if not self.meetings:
+            return []
+        keys = [key for key, _ in self.meetings]
+        weights = [paths for _, paths in self.meetings]
+        paths = {}
+        # Stop early when there are fewer paths than asked for.
+        for _ in range(count * 4):
+            if len(paths) >= count:
+                break
+            meeting = rng.choices(keys, weights)[0]
+            path = (
+                self.forward.sample_path_to_root(meeting, rng)[::-1]
+                + self.backward.sample_path_to_root(meeting, rng)[1:]
+            )
+            paths[tuple(path)] = path
+        return list(paths.values())
+
+
+def describe(key):
+    node_type, node_id = key
+    if node_type == Node.Type.FILM:
+        return f'{node_type} #{node_id}: {get_movie_info(node_id)["title"]}'
+    return f'{node_type} #{node_id}: {get_persons_info(node_id)["name"]}'
+
+
+def find_shortest_solution(start, end, max_depth=6, save_to_db=False, max_workers=None):
     """
     Find the shortest route between two Nodes.
     `start` and `end` attributes should be FilmNodes or PersonNodes.
     A quick test is:
      * FilmNode(744): Top Gun, to
      * FilmNode(817): Austin Powers: The Spy Who Shagged Me
+    Each BFS level is expanded concurrently on `max_workers` threads.
+    Returns the list of IDs on the route, or None if there isn't one.
     """
-    to_check = [start]
-    failed_to_find = False    
-    checked = set()
-    
-    while to_check:
-        current_node = to_check.pop(0)
-        current_node.populate_children()
-        to_check += list(current_node.children - checked)
-        checked.add(current_node)
-        if end in to_check:
-            end = [node for node in to_check if node == end][0]
-            break
-        elif current_node.get_depth() > max_depth:
-            failed_to_find = True
-            break
-        print('.', end= ' ')
-    
+    with ConcurrentExpander(max_workers) as expander:
+        search = BidirectionalSearch(start.key, end.key, max_depth, expander)
+        path = search.run()
+
+    if path is None:
+        print(f'Failed to find a solution in {max_depth} or fewer steps.')
+        return None
+
+    path_ids = [node_id for _, node_id in path]
     if save_to_db:
         puzzle, created = (
             Puzzle.objects
@@ -211,10 +473,10 @@ def find_shortest_solution(start, end, max_depth=6, save_to_db=False):
                 end_movie_id=end.node_id,
             )
         )
-        Solution.objects.get_or_create(puzzle=puzzle, solution=end.path_array([]))
-    elif failed_to_find:
-        print(f'Failed to find a solution in {max_depth} or fewer steps.')
+        Solution.objects.get_or_create(puzzle=puzzle, solution=path_ids)
+        puzzle.rebuild_length_histogram()
     else:
-        print()
-        end.pprint([])
-        print(end.path_array([]))
\ No newline at end of file
+        print(f'Found in {search.expansions} expansions.')
+        print(' > '.join(describe(key) for key in path))
+        print(path_ids)
+    return path_ids
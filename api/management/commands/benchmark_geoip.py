@@ -0,0 +1,65 @@
+import random
+import time
+
+from django.contrib.gis.geoip2 import GeoIP2
+from django.core.management.base import BaseCommand, CommandError
+
+from api.utils import DEFAULT_TIMEZONE, get_geoip, get_ip_timezone
+
+
+def uncached_ip_timezone(ip):
+    """
+    Looks up an IP's timezone the way every request used to,
+    opening the GeoIP database each time.
+    """
+    try:
+        return GeoIP2().city(ip)['time_zone'] or DEFAULT_TIMEZONE
+    except:
+        return DEFAULT_TIMEZONE
+
+
+class Command(BaseCommand):
+    help = (
+        'Times looking up client timezones with a GeoIP2 reader opened per call '
+        'against the shared reader and LRU cache the views use'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookups', type=int, default=10000, help='Lookups to time for each.')
+        parser.add_argument(
+            '--ips',
+            type=int,
+            default=1000,
+            help='Distinct client IPs the lookups are drawn from, as repeat visitors come back.',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the random IPs.')
+
+    def handle(self, *args, **options):
+        if get_geoip() is None:
+            raise CommandError('The GeoIP database could not be opened from GEOIP_PATH.')
+
+        rng = random.Random(options['seed'])
+        ips = [
+            '.'.join(str(rng.randint(1, 223)) for _ in range(4))
+            for _ in range(options['ips'])
+        ]
+        lookups = [rng.choice(ips) for _ in range(options['lookups'])]
+
+        get_ip_timezone.cache_clear()
+        timings = {}
+        timezones = {}
+        for name, lookup in (('Per call', uncached_ip_timezone), ('Cached', get_ip_timezone)):
+            started = time.perf_counter()
+            timezones[name] = [lookup(ip) for ip in lookups]
+            timings[name] = time.perf_counter() - started
+            self.stdout.write(
+                f'{name}: {len(lookups)} lookups in {timings[name]:.2f}s, '
+                f'{timings[name] / len(lookups) * 1e6:.1f}us each'
+            )
+        if timezones['Per call'] != timezones['Cached']:
+            raise CommandError('The cached lookups found different timezones.')
+
+        self.stdout.write(f'Cache {get_ip_timezone.cache_info()}')
+        self.stdout.write(self.style.SUCCESS(
+            f'The cached lookups were {timings["Per call"] / timings["Cached"]:.1f}x faster.'
+        ))
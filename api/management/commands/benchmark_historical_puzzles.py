@@ -0,0 +1,61 @@
+import datetime
+import pickle
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+from api.models import Puzzle
+from api.utils import historical_puzzles
+
+
+class HistoricalPuzzleSerializer(serializers.Serializer):
+    """
+    What the historical puzzles used to be validated with on every request.
+    """
+    id = serializers.IntegerField()
+    datetime = serializers.CharField()
+
+
+class Command(BaseCommand):
+    help = (
+        'Times building the historical puzzles payload for a large archive as plain dicts '
+        'against validating it with a serializer as it used to be'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--puzzles', type=int, default=10000, help='Puzzles in the archive.')
+        parser.add_argument('--rounds', type=int, default=20, help='Times to build the payload each way.')
+
+    def handle(self, *args, **options):
+        first = datetime.date(2022, 1, 1)
+        # Unsaved, so only building the payload is timed, not the query.
+        puzzles = [
+            Puzzle(id=day + 1, start_movie_id=1, end_movie_id=2, date_active=first + datetime.timedelta(days=day))
+            for day in range(options['puzzles'])
+        ]
+
+        def validated():
+            serializer = HistoricalPuzzleSerializer(data=historical_puzzles(puzzles), many=True)
+            serializer.is_valid(raise_exception=True)
+            return serializer.validated_data
+
+        timings = {}
+        payloads = {}
+        for name, build in (('Serializer', validated), ('Plain dicts', lambda: historical_puzzles(puzzles))):
+            started = time.perf_counter()
+            for _ in range(options['rounds']):
+                payloads[name] = build()
+            timings[name] = (time.perf_counter() - started) / options['rounds']
+            self.stdout.write(
+                f'{name}: {timings[name] * 1000:.1f}ms per payload, '
+                f'{len(pickle.dumps(payloads[name], pickle.HIGHEST_PROTOCOL))} bytes pickled'
+            )
+
+        if JSONRenderer().render(payloads['Serializer']) != JSONRenderer().render(payloads['Plain dicts']):
+            raise CommandError('The payloads render differently.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Plain dicts were {timings["Serializer"] / timings["Plain dicts"]:.1f}x faster '
+            f'for {options["puzzles"]} puzzles.'
+        ))
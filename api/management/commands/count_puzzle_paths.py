@@ -0,0 +1,55 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.analysis import cache_shortest_paths, find_shortest_paths, get_shortest_paths
+from api.helpers import ConcurrentExpander
+from api.models import Puzzle
+
+
+class Command(BaseCommand):
+    help = (
+        'Counts the shortest paths between the films of puzzles and caches them '
+        'for the admin and the metrics endpoint, which never search themselves'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help='Count puzzles active from today for this many days.',
+        )
+        parser.add_argument('--puzzle', type=int, action='append', dest='puzzle_ids', help='Count this puzzle instead.')
+        parser.add_argument('--all', action='store_true', help='Count every puzzle instead.')
+        parser.add_argument('--force', action='store_true', help='Count puzzles again even if they are cached.')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        puzzles = Puzzle.objects.order_by('date_active', 'id')
+        if options['puzzle_ids']:
+            puzzles = puzzles.filter(id__in=options['puzzle_ids'])
+        elif not options['all']:
+            today = timezone.localdate()
+            puzzles = puzzles.filter(
+                date_active__gte=today,
+                date_active__lt=today + datetime.timedelta(days=options['days']),
+            )
+
+        counted = 0
+        # Puzzles chain end film to start film, so their searches overlap.
+        with ConcurrentExpander(remember=True) as expander:
+            for puzzle in puzzles:
+                if not options['force'] and get_shortest_paths(puzzle.start_movie_id, puzzle.end_movie_id):
+                    continue
+                paths = find_shortest_paths(puzzle.start_movie_id, puzzle.end_movie_id, expander)
+                cache_shortest_paths(puzzle.start_movie_id, puzzle.end_movie_id, paths)
+                counted += 1
+                self.stdout.write(
+                    f'{puzzle}: {paths["num_shortest_paths"]} shortest paths '
+                    f'of {paths["shortest_path_steps"]} steps'
+                )
+
+        self.stdout.write(self.style.SUCCESS(f'Counted {counted} puzzles in {time.time() - started:.1f}s.'))
@@ -8,4 +8,5 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         puzzle, _ = Puzzle.objects.get_or_create(start_movie_id=935516, end_movie_id=744)
         Solution.objects.get_or_create(token='xxx', puzzle=puzzle, solution=[935516,62752,466272,138,319,893,744])
+        puzzle.rebuild_length_histogram()
         self.stdout.write(self.style.SUCCESS('Created.'))
\ No newline at end of file
@@ -0,0 +1,230 @@
+import datetime
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.analysis import cache_shortest_paths, summarize_search
+from api.graph import get_graph
+from api.helpers import BidirectionalSearch, ConcurrentExpander, Node
+from api.models import Puzzle
+from api.utils import get_movie_credit_ids, get_movie_info, get_person_credit_ids
+
+DIFFICULTIES = ('hard', 'medium', 'easy')
+
+
+class Candidate:
+    """
+    A possible end film for a puzzle, with what its search found.
+    """
+
+    def __init__(self, end_movie_id, num_shortest_paths, popularity, paths):
+        self.end_movie_id = end_movie_id
+        self.num_shortest_paths = num_shortest_paths
+        # What count_puzzle_paths would find, cached for the puzzle if it's chosen.
+        self.paths = paths
+        # Mean popularity of the films and people between start and end, if known.
+        self.popularity = popularity
+
+    @property
+    def difficulty(self):
+        """
+        Sort key, hardest first: fewer shortest paths, then less popular steps.
+        """
+        return (self.num_shortest_paths, self.popularity if self.popularity is not None else 0)
+
+
+def sample_popular_films(graph, count, min_popularity, exclude):
+    """
+    Returns up to `count` films from the graph store above `min_popularity`,
+    sampled in proportion to their popularity.
+    """
+    popularity = np.asarray(graph.movie_popularity, dtype=np.float64)
+    eligible = np.flatnonzero(popularity > min_popularity)
+    ids = np.asarray(graph.movie_ids)[eligible]
+    keep = ~np.isin(ids, list(exclude))
+    ids, weights = ids[keep], popularity[eligible][keep]
+    if not len(ids):
+        return []
+    chosen = np.random.choice(len(ids), size=min(count, len(ids)), replace=False, p=weights / weights.sum())
+    return ids[chosen].tolist()
+
+
+def random_walk_films(start_movie_id, steps, count, exclude):
+    """
+    Returns up to `count` films reached by random walks of `steps` steps from the start,
+    for when there's no graph store to sample from. Walks can loop back,
+    so the films may be closer than `steps`: the searches sort that out.
+    """
+    films = set()
+    for _ in range(count * 3):
+        if len(films) >= count:
+            break
+        movie_id = start_movie_id
+        try:
+            for _ in range(steps // 2):
+                person_id = random.choice(get_movie_credit_ids(movie_id))
+                movie_id = random.choice(get_person_credit_ids(person_id))
+        except IndexError:
+            continue
+        if movie_id not in exclude:
+            films.add(movie_id)
+    return list(films)
+
+
+class Command(BaseCommand):
+    help = (
+        'Schedules puzzles for the coming days, each starting where the last one ended, '
+        'with end films checked to be exactly --steps steps away and ranked by difficulty'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Schedule puzzles for this many days.')
+        parser.add_argument(
+            '--start-date',
+            type=datetime.date.fromisoformat,
+            default=None,
+            help='First date to schedule, by default the day after the last scheduled puzzle.',
+        )
+        parser.add_argument(
+            '--start-movie',
+            type=int,
+            default=None,
+            help='Film to start from, by default the end film of the last scheduled puzzle.',
+        )
+        parser.add_argument('--steps', type=int, default=6, help='Exact number of steps from start to end.')
+        parser.add_argument('--candidates', type=int, default=20, help='End films to try for each day.')
+        parser.add_argument(
+            '--min-popularity',
+            type=float,
+            default=20,
+            help='Only try end films more popular than this, when sampling from the graph store.',
+        )
+        parser.add_argument(
+            '--difficulty',
+            choices=DIFFICULTIES,
+            default='medium',
+            help='Which of the ranked candidates to schedule.',
+        )
+        parser.add_argument('--workers', type=int, default=4, help='Candidates to search at once.')
+        parser.add_argument('--author', default='generator', help='Author recorded on the puzzles.')
+        parser.add_argument('--dry-run', action='store_true', help='Print the puzzles without saving them.')
+
+    def handle(self, *args, **options):
+        if options['steps'] % 2:
+            raise CommandError('Paths between films take an even number of steps.')
+
+        started = time.time()
+        last = Puzzle.objects.filter(date_active__isnull=False).order_by('-date_active', '-id').first()
+
+        start_movie_id = options['start_movie'] or (last and last.end_movie_id)
+        if not start_movie_id:
+            raise CommandError('There is no scheduled puzzle to continue from, pass --start-movie.')
+        date = options['start_date']
+        if date is None:
+            date = max(last.date_active + datetime.timedelta(days=1), timezone.localdate()) if last else timezone.localdate()
+
+        self.graph = get_graph()
+        self.options = options
+        used = set(Puzzle.objects.values_list('start_movie_id', flat=True))
+        used.update(Puzzle.objects.values_list('end_movie_id', flat=True))
+        used.add(start_movie_id)
+
+        puzzles = []
+        chosen_paths = []
+        # Every candidate search starts from the same film, so remember every
+        # credit list rather than requesting the neighbourhood again each time.
+        with ConcurrentExpander(remember=True) as expander, ThreadPoolExecutor(options['workers']) as executor:
+            for day in range(options['days']):
+                candidates = self.rank(start_movie_id, used, expander, executor)
+                if not candidates:
+                    self.stdout.write(self.style.WARNING(
+                        f'No film is exactly {options["steps"]} steps from {start_movie_id}, stopping.'
+                    ))
+                    break
+                chosen = self.choose(candidates)
+                chosen_paths.append(chosen.paths)
+                puzzles.append(Puzzle(
+                    start_movie_id=start_movie_id,
+                    end_movie_id=chosen.end_movie_id,
+                    date_active=date + datetime.timedelta(days=day),
+                    author=options['author'],
+                ))
+                self.describe(puzzles[-1], chosen, len(candidates))
+                used.add(chosen.end_movie_id)
+                start_movie_id = chosen.end_movie_id
+
+        if not options['dry_run']:
+            Puzzle.objects.bulk_create(puzzles)
+            for puzzle, paths in zip(puzzles, chosen_paths):
+                cache_shortest_paths(puzzle.start_movie_id, puzzle.end_movie_id, paths)
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Found" if options["dry_run"] else "Scheduled"} {len(puzzles)} puzzles in {time.time() - started:.1f}s.'
+        ))
+
+    def rank(self, start_movie_id, used, expander, executor):
+        """
+        Returns the sampled end films exactly --steps away, hardest first.
+        """
+        steps = self.options['steps']
+        count = self.options['candidates']
+        if self.graph is not None:
+            films = sample_popular_films(self.graph, count, self.options['min_popularity'], used)
+        else:
+            films = random_walk_films(start_movie_id, steps, count, used)
+
+        searches = executor.map(lambda end: self.search(start_movie_id, end, expander), films)
+        candidates = [candidate for candidate in searches if candidate is not None]
+        return sorted(candidates, key=lambda candidate: candidate.difficulty)
+
+    def search(self, start_movie_id, end_movie_id, expander):
+        """
+        Returns a Candidate if the shortest path to `end_movie_id` is exactly --steps long.
+        """
+        steps = self.options['steps']
+        search = BidirectionalSearch(
+            (Node.Type.FILM, start_movie_id),
+            (Node.Type.FILM, end_movie_id),
+            max_depth=steps,
+            expand_level=expander,
+        )
+        path = search.run()
+        if path is None or len(path) - 1 != steps:
+            return None
+        return Candidate(
+            end_movie_id,
+            search.num_shortest_paths,
+            self.popularity(path[1:-1]),
+            summarize_search(search, path),
+        )
+
+    def popularity(self, keys):
+        if self.graph is None:
+            return None
+        values = []
+        for node_type, node_id in keys:
+            name = 'movie' if node_type == Node.Type.FILM else 'person'
+            index = self.graph.index(name, node_id)
+            if index is not None:
+                values.append(float(getattr(self.graph, f'{name}_popularity')[index]))
+        return sum(values) / len(values) if values else None
+
+    def choose(self, candidates):
+        position = {
+            'hard': 0,
+            'medium': len(candidates) // 2,
+            'easy': len(candidates) - 1,
+        }[self.options['difficulty']]
+        return candidates[position]
+
+    def describe(self, puzzle, candidate, num_candidates):
+        popularity = f'{candidate.popularity:.1f}' if candidate.popularity is not None else 'unknown'
+        self.stdout.write(
+            f'{puzzle.date_active}: {get_movie_info(puzzle.start_movie_id)["title"]} > '
+            f'{get_movie_info(puzzle.end_movie_id)["title"]} '
+            f'({candidate.num_shortest_paths} shortest paths, intermediate popularity {popularity}, '
+            f'{num_candidates} candidates)'
+        )
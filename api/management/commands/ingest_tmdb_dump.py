@@ -0,0 +1,80 @@
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.graph import GraphBuilder
+from api.helpers import MIN_FILM_POPULARITY, MIN_PERSON_POPULARITY, safe_jobs
+
+
+def read_dump(path):
+    """
+    Yields one record per line of a gzipped JSON-lines dump.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as dump:
+        for line in dump:
+            if line.strip():
+                yield json.loads(line)
+
+
+def popular(records, threshold):
+    for record in records:
+        if record.get('popularity', 0) > threshold:
+            yield record
+
+
+def useful_credits(record):
+    """
+    Yields (person, job) for every credit of a film the solver would follow:
+    all cast, crew with well known jobs, and only people popular enough.
+    """
+    cast = record.get('cast', [])
+    crew = [credit for credit in record.get('crew', []) if credit.get('job') in safe_jobs]
+    for person in popular(cast + crew, MIN_PERSON_POPULARITY):
+        yield person, person.get('job')
+
+
+class Command(BaseCommand):
+    help = 'Builds the graph store from TMDB daily export dumps'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', required=True, help='Gzipped JSON-lines dump of movie ids.')
+        parser.add_argument('--people', required=True, help='Gzipped JSON-lines dump of person ids.')
+        parser.add_argument(
+            '--credits',
+            required=True,
+            help='Gzipped JSON-lines dump of movie credits, one {"id", "cast", "crew"} object per line.',
+        )
+
+    def handle(self, *args, **options):
+        started = time.time()
+        refreshed = int(started)
+        builder = GraphBuilder()
+
+        # Only films and people in the credits dump have their credits loaded in full,
+        # the others are left for the solver to request from tmdb.
+        movies = 0
+        for movie in popular(read_dump(options['movies']), MIN_FILM_POPULARITY):
+            builder.add_movie({**movie, 'title': movie.get('title') or movie.get('original_title')})
+            movies += 1
+
+        people = 0
+        for person in popular(read_dump(options['people']), MIN_PERSON_POPULARITY):
+            builder.add_person(person)
+            people += 1
+
+        credits = 0
+        for record in read_dump(options['credits']):
+            builder.mark_movie_refreshed(record['id'], refreshed)
+            for person, job in useful_credits(record):
+                # Credits carry profile paths the person dump doesn't have.
+                builder.add_person(person, refreshed=refreshed)
+                builder.add_credit(record['id'], person['id'], job)
+                credits += 1
+
+        builder.build()
+        self.stdout.write(self.style.SUCCESS(
+            f'Ingested {movies} films, {people} people and {credits} credits '
+            f'in {time.time() - started:.1f}s.'
+        ))
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from collections import Counter
+
+import httpx
+from django.core.management.base import BaseCommand
+
+DEFAULT_PATHS = [
+    '/api/movie/744/crew/',
+    '/api/movie/744/',
+    '/api/person/500/filmography/',
+    '/api/person/500/',
+]
+
+
+def percentile(ordered, fraction):
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Sends concurrent requests to a running server and reports throughput, '
+        'latency percentiles and how many requests were in flight at once'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Server to test.')
+        parser.add_argument(
+            '--path',
+            action='append',
+            dest='paths',
+            help='Path to request, may be given more than once. Defaults to some tmdb-backed endpoints.',
+        )
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests to keep in flight.')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests to send in total.')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or DEFAULT_PATHS
+        latencies, statuses, peak, elapsed = asyncio.run(self.run(
+            options['url'], paths, options['concurrency'], options['requests'],
+        ))
+
+        latencies.sort()
+        self.stdout.write(f'{len(latencies)} requests in {elapsed:.2f}s, {len(latencies) / elapsed:.1f} requests/s')
+        self.stdout.write(
+            'Latency p50 {:.0f}ms, p95 {:.0f}ms, p99 {:.0f}ms, max {:.0f}ms'.format(
+                *(percentile(latencies, fraction) * 1000 for fraction in (0.5, 0.95, 0.99, 1)),
+            )
+        )
+        self.stdout.write(f'Statuses {dict(statuses)}')
+        self.stdout.write(self.style.SUCCESS(f'At most {peak} requests were in flight at once.'))
+
+    async def run(self, url, paths, concurrency, total):
+        latencies = []
+        statuses = Counter()
+        remaining = iter(range(total))
+        in_flight = peak = 0
+
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+            async def worker():
+                nonlocal in_flight, peak
+                for number in remaining:
+                    started = time.perf_counter()
+                    in_flight += 1
+                    peak = max(peak, in_flight)
+                    try:
+                        response = await client.get(paths[number % len(paths)])
+                        statuses[response.status_code] += 1
+                    except httpx.HTTPError as exc:
+                        statuses[type(exc).__name__] += 1
+                    in_flight -= 1
+                    latencies.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, statuses, peak, time.perf_counter() - started
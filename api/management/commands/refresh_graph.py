@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.graph import refresh_stale_nodes
+from api.tmdb_client import get_client
+
+
+def fetch_movie_credits(movie_id):
+    return get_client().movie_credits(movie_id)
+
+
+def fetch_person_credits(person_id):
+    return get_client().person_movie_credits(person_id)
+
+
+class Command(BaseCommand):
+    help = 'Requests fresh credits from tmdb for stale films and people in the graph store'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age',
+            type=int,
+            default=settings.GRAPH_STALE_AFTER_IN_SECONDS,
+            help='Refresh nodes last loaded more than this many seconds ago.',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Refresh at most this many films and this many people.',
+        )
+
+    def handle(self, *args, **options):
+        graph, refreshed = refresh_stale_nodes(
+            fetch_movie_credits,
+            fetch_person_credits,
+            max_age=options['max_age'],
+            limit=options['limit'],
+        )
+        if graph is None:
+            self.stdout.write(self.style.WARNING('There is no graph store to refresh.'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {refreshed} nodes.'))
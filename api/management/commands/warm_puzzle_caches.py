@@ -0,0 +1,135 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.helpers import Node
+from api.models import Puzzle
+from api.utils import get_movie_cast_and_crew, get_movie_info, get_persons_filmography
+
+
+class RateLimiter:
+    """
+    Spaces out calls to at most `rate` per second.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_call = time.monotonic()
+
+    def wait(self):
+        now = time.monotonic()
+        if self.next_call > now:
+            time.sleep(self.next_call - now)
+        self.next_call = max(now, self.next_call) + self.interval
+
+
+class Command(BaseCommand):
+    help = (
+        'Primes the caches for the start and end movies of upcoming puzzles '
+        'and the films and people around them, most popular first'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=2,
+            help='Warm puzzles active from today for this many days.',
+        )
+        parser.add_argument(
+            '--depth',
+            type=int,
+            default=2,
+            help='Follow credits this many steps out from each start and end movie.',
+        )
+        parser.add_argument(
+            '--breadth',
+            type=int,
+            default=25,
+            help='Follow only this many most popular credits of each film or person.',
+        )
+        parser.add_argument(
+            '--max-keys',
+            type=int,
+            default=2000,
+            help='Stop after requesting this many keys from tmdb.',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=10,
+            help='Make at most this many requests to tmdb per second.',
+        )
+        parser.add_argument(
+            '--fresh-for',
+            type=int,
+            default=60 * 60 * 6,
+            help='Request again anything cached that goes stale within this many seconds.',
+        )
+
+    def handle(self, *args, **options):
+        started = time.time()
+        today = timezone.localdate()
+        puzzles = Puzzle.objects.filter(
+            date_active__gte=today,
+            date_active__lt=today + datetime.timedelta(days=options['days']),
+        ).order_by('date_active')
+
+        self.limiter = RateLimiter(options['rate'])
+        self.ahead = options['fresh_for']
+        self.warmed = 0
+
+        roots = set()
+        for puzzle in puzzles:
+            for movie_id in (puzzle.start_movie_id, puzzle.end_movie_id):
+                self.warm(get_movie_info, movie_id)
+                roots.add((Node.Type.FILM, movie_id))
+
+        self.walk(roots, options['depth'], options['breadth'], options['max_keys'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Warmed {self.warmed} keys for {len(puzzles)} puzzles in {time.time() - started:.1f}s.'
+        ))
+
+    def warm(self, memoized, node_id):
+        """
+        Returns a memoized result, requesting it from tmdb within the rate budget
+        unless it's cached and fresh enough.
+        """
+        result, called = memoized.warm(node_id, ahead=self.ahead)
+        if called:
+            self.warmed += 1
+            self.limiter.wait()
+        return result
+
+    def credits(self, key):
+        """
+        Returns a film's cast and crew or a person's filmography, ordered by popularity.
+        """
+        node_type, node_id = key
+        if node_type == Node.Type.FILM:
+            return self.warm(get_movie_cast_and_crew, node_id)
+        return self.warm(get_persons_filmography, node_id)
+
+    def walk(self, roots, depth, breadth, max_keys):
+        """
+        Breadth-first walk out from `roots`, one level per step.
+        Credit lists are ordered by popularity, so each level is visited
+        in order of the best place its nodes had in any of them.
+        """
+        seen = set(roots)
+        level = sorted(roots)
+        for _ in range(depth):
+            ranks = {}
+            for key in level:
+                if self.warmed >= max_keys:
+                    return
+                neighbour_type = Node.Type.PERSON if key[0] == Node.Type.FILM else Node.Type.FILM
+                for rank, credit in enumerate(self.credits(key)[:breadth]):
+                    neighbour = (neighbour_type, credit['id'])
+                    if neighbour not in seen and rank < ranks.get(neighbour, breadth):
+                        ranks[neighbour] = rank
+            seen.update(ranks)
+            level = sorted(ranks, key=ranks.get)
@@ -0,0 +1,49 @@
+from collections import namedtuple
+
+PuzzleMetrics = namedtuple('PuzzleMetrics', [
+    'num_solved',
+    'num_solutions',
+    'shortest_solution',
+    'longest_solution',
+    'average_steps',
+    'median_steps',
+])
+
+
+def weighted_median(histogram):
+    """
+    Median of a list of (value, count) pairs ordered by value.
+    Gives the same result as np.median over the list with every
+    value repeated `count` times, without building that list.
+    """
+    total = sum(count for _, count in histogram)
+    if not total:
+        return None
+
+    lower_rank, upper_rank = (total - 1) // 2, total // 2
+    lower = None
+    seen = 0
+    for value, count in histogram:
+        seen += count
+        if lower is None and seen > lower_rank:
+            lower = value
+        if seen > upper_rank:
+            return (lower + value) / 2
+
+
+def metrics_from_histogram(histogram):
+    """
+    Builds PuzzleMetrics from a list of (steps, plays, solutions) ordered by steps,
+    where `plays` is how many times solutions of that length were submitted
+    and `solutions` is how many distinct solutions have that length.
+    """
+    played = [(steps, plays) for steps, plays, _ in histogram if plays]
+    num_solved = sum(plays for _, plays in played)
+    return PuzzleMetrics(
+        num_solved=num_solved,
+        num_solutions=sum(solutions for _, _, solutions in histogram),
+        shortest_solution=played[0][0] if played else None,
+        longest_solution=played[-1][0] if played else None,
+        average_steps=sum(steps * plays for steps, plays in played) / num_solved if played else None,
+        median_steps=weighted_median(played),
+    )
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.14 on 2026-10-18 09:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_solution_lengths(apps, schema_editor):
+    Solution = apps.get_model('api', 'Solution')
+    SolutionLengthCount = apps.get_model('api', 'SolutionLengthCount')
+    histogram = (
+        Solution.objects
+        .annotate(steps=models.Func(models.F('solution'), function='CARDINALITY', output_field=models.IntegerField()) - 1)
+        .values('puzzle_id', 'steps')
+        .annotate(plays=models.Sum('count'), solutions=models.Count('id'))
+        .values_list('puzzle_id', 'steps', 'plays', 'solutions')
+    )
+    SolutionLengthCount.objects.bulk_create([
+        SolutionLengthCount(puzzle_id=puzzle_id, steps=steps, plays=plays, solutions=solutions)
+        for puzzle_id, steps, plays, solutions in histogram
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_puzzle_author'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SolutionLengthCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('steps', models.IntegerField()),
+                ('plays', models.IntegerField(default=0)),
+                ('solutions', models.IntegerField(default=0)),
+                ('puzzle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='length_counts', to='api.puzzle')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='solutionlengthcount',
+            constraint=models.UniqueConstraint(fields=('puzzle', 'steps'), name='unique_puzzle_steps'),
+        ),
+        migrations.RunPython(count_solution_lengths, migrations.RunPython.noop),
+    ]
@@ -1,14 +1,20 @@
 from django.contrib.postgres.fields import ArrayField
 from django.utils.crypto import get_random_string  
-from django.db import models
+from django.utils.functional import cached_property
+from django.db import connection, models, transaction
 
-import numpy as np
+from api.metrics import metrics_from_histogram
 
 
 def generate_token():
     return get_random_string(length=8)
 
 
+class ArrayLength(models.Func):
+    function = 'CARDINALITY'
+    output_field = models.IntegerField()
+
+
 class Puzzle(models.Model):
     start_movie_id = models.IntegerField(null=False, blank=False)
     end_movie_id = models.IntegerField(null=False, blank=False)
@@ -23,43 +29,64 @@ class Puzzle(models.Model):
             string += self.date_active.strftime(": %Y%m%d")
         return string
 
+    @cached_property
+    def metrics(self):
+        return metrics_from_histogram(self.length_histogram())
+
     @property
     def num_solved(self):
-        return sum(self.solutions.values_list('count', flat=True))
+        return self.metrics.num_solved
 
     @property
     def num_solutions(self):
-        return self.solutions.count()
+        return self.metrics.num_solutions
 
     @property
     def shortest_solution(self):
-        lengths = self.all_solution_lengths()
-        if lengths:
-            return min(lengths)
+        return self.metrics.shortest_solution
 
     @property
     def longest_solution(self):
-        lengths = self.all_solution_lengths()
-        if lengths:
-            return max(lengths)
+        return self.metrics.longest_solution
 
     @property
     def average_steps(self):
-        lengths = self.all_solution_lengths()
-        if lengths:
-            return np.mean(lengths)
+        return self.metrics.average_steps
 
     @property
     def median_steps(self):
-        lengths = self.all_solution_lengths()
-        if lengths:
-            return np.median(lengths)
+        return self.metrics.median_steps
+
+    def length_histogram(self):
+        """
+        Returns (steps, plays, solutions) for each solution length, ordered by steps,
+        from the histogram kept up to date as solutions are submitted.
+        """
+        return list(
+            self.length_counts
+            .order_by('steps')
+            .values_list('steps', 'plays', 'solutions')
+        )
 
-    def all_solution_lengths(self):
-        solution_lengths = []
-        for solution in self.solutions.all():
-            solution_lengths += [solution.num_degrees] * solution.count
-        return solution_lengths
+    def rebuild_length_histogram(self):
+        """
+        Recounts the histogram from this puzzle's solutions,
+        for when solutions are changed other than by being submitted.
+        """
+        histogram = (
+            self.solutions
+            .annotate(steps=ArrayLength('solution') - 1)
+            .values('steps')
+            .annotate(plays=models.Sum('count'), solutions=models.Count('id'))
+            .order_by('steps')
+            .values_list('steps', 'plays', 'solutions')
+        )
+        with transaction.atomic():
+            self.length_counts.all().delete()
+            SolutionLengthCount.objects.bulk_create([
+                SolutionLengthCount(puzzle=self, steps=steps, plays=plays, solutions=solutions)
+                for steps, plays, solutions in histogram
+            ])
 
 class Solution(models.Model):
     token = models.CharField(max_length=100, default=generate_token, unique=True)
@@ -80,3 +107,64 @@ class Solution(models.Model):
     def num_degrees(self):
         if self.solution:
             return len(self.solution) - 1
+
+    @classmethod
+    def submit(cls, puzzle, solution):
+        """
+        Counts one submission of `solution` to `puzzle`, creating it if it's new,
+        and updates the puzzle's length histogram, all in one statement.
+        Returns None if the same path is already a solution to a different puzzle.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH submitted AS (
+                    INSERT INTO {cls._meta.db_table}
+                        (token, puzzle_id, solution, count, object_created, object_modified)
+                    VALUES (%s, %s, %s, 1, NOW(), NOW())
+                    ON CONFLICT (solution) DO UPDATE
+                    SET count = {cls._meta.db_table}.count + 1,
+                        object_modified = NOW()
+                    WHERE {cls._meta.db_table}.puzzle_id = EXCLUDED.puzzle_id
+                    RETURNING id, token, count, (xmax = 0) AS created
+                ), counted AS (
+                    INSERT INTO {SolutionLengthCount._meta.db_table} (puzzle_id, steps, plays, solutions)
+                    SELECT %s, %s, 1, created::int FROM submitted
+                    ON CONFLICT (puzzle_id, steps) DO UPDATE
+                    SET plays = {SolutionLengthCount._meta.db_table}.plays + 1,
+                        solutions = {SolutionLengthCount._meta.db_table}.solutions + EXCLUDED.solutions
+                )
+                SELECT id, token, count FROM submitted
+                """,
+                [generate_token(), puzzle.id, list(solution), puzzle.id, len(solution) - 1],
+            )
+            row = cursor.fetchone()
+
+        if row is None:
+            return None
+        pk, token, count = row
+        submitted = cls(id=pk, token=token, puzzle=puzzle, solution=list(solution), count=count)
+        submitted._state.adding = False
+        return submitted
+
+
+class SolutionLengthCount(models.Model):
+    """
+    How many times solutions of a given length have been submitted for a puzzle,
+    and how many distinct solutions have that length.
+    """
+    puzzle = models.ForeignKey(
+        Puzzle,
+        on_delete=models.CASCADE,
+        related_name='length_counts',
+        blank=False,
+        null=False,
+    )
+    steps = models.IntegerField()
+    plays = models.IntegerField(default=0)
+    solutions = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['puzzle', 'steps'], name='unique_puzzle_steps'),
+        ]
@@ -0,0 +1,63 @@
+from requests.exceptions import HTTPError
+
+from api.graph import get_graph
+from api.utils import contains_id, get_movie_credit_ids, get_person_credit_ids
+
+
+class PathChecker:
+    """
+    Checks solutions against the credits players build them from,
+    looking up each film's and person's credits at most once,
+    so checking a path takes a lookup or two per step.
+    """
+
+    def __init__(self):
+        self.graph = get_graph()
+        self.credit_ids = {}
+
+    def ids(self, get_credit_ids, node_id):
+        """
+        Returns the packed ids in a credit list, empty if tmdb doesn't know the id.
+        """
+        key = (get_credit_ids, node_id)
+        if key not in self.credit_ids:
+            try:
+                self.credit_ids[key] = get_credit_ids(node_id)
+            except HTTPError as exc:
+                if exc.response is None or exc.response.status_code != 404:
+                    raise
+                self.credit_ids[key] = ()
+        return self.credit_ids[key]
+
+    def is_credited(self, movie_id, person_id):
+        """
+        Whether a person is in a film's cast and crew or the film is in their filmography.
+        """
+        if self.graph is not None and self.graph.has_credit(movie_id, person_id):
+            return True
+        return (
+            contains_id(self.ids(get_movie_credit_ids, movie_id), person_id)
+            or contains_id(self.ids(get_person_credit_ids, person_id), movie_id)
+        )
+
+    def errors(self, puzzle, solution):
+        """
+        Returns the reasons `solution` doesn't solve `puzzle`, empty if it does.
+        """
+        if len(solution) < 3 or len(solution) % 2 == 0:
+            return ['A solution alternates between films and people, starting and ending with a film.']
+
+        errors = []
+        if solution[0] != puzzle.start_movie_id:
+            errors.append(f'A solution must start with film {puzzle.start_movie_id}.')
+        if solution[-1] != puzzle.end_movie_id:
+            errors.append(f'A solution must end with film {puzzle.end_movie_id}.')
+        if errors:
+            return errors
+
+        for index in range(1, len(solution), 2):
+            person_id = solution[index]
+            for movie_id in (solution[index - 1], solution[index + 1]):
+                if not self.is_credited(movie_id, person_id):
+                    errors.append(f'Person {person_id} is not credited on film {movie_id}.')
+        return errors
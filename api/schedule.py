@@ -0,0 +1,123 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.models import Puzzle
+
+FIELDS = ('id', 'start_movie_id', 'end_movie_id', 'date_active', 'author')
+
+
+class PuzzleSchedule:
+    """
+    In-memory index of scheduled puzzles ordered by date_active,
+    so finding the puzzles available on a date is a bisect instead of a query.
+
+    Saving or deleting a Puzzle clears the index in this process. Other processes
+    notice the change within PUZZLE_SCHEDULE_CHECK_INTERVAL_IN_SECONDS, by comparing
+    the number of puzzles and when one was last modified.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fingerprint = None
+        self.checked = 0
+        # (dates, puzzles, id -> position, (date, id) keys),
+        # replaced as a whole so readers never see a mix.
+        self.index = ([], [], {}, [])
+
+    def invalidate(self):
+        self.fingerprint = None
+
+    @property
+    def version(self):
+        """
+        Changes whenever a puzzle is added, changed or deleted, the same in every process.
+        """
+        self.refresh()
+        fingerprint = self.fingerprint
+        modified = fingerprint['modified'].timestamp() if fingerprint['modified'] else 0
+        return f'{fingerprint["count"]}-{modified}'
+
+    def refresh(self):
+        if self.fingerprint is not None and time.monotonic() - self.checked < settings.PUZZLE_SCHEDULE_CHECK_INTERVAL_IN_SECONDS:
+            return self.index
+        with self.lock:
+            if self.fingerprint is not None and time.monotonic() - self.checked < settings.PUZZLE_SCHEDULE_CHECK_INTERVAL_IN_SECONDS:
+                return self.index
+            fingerprint = Puzzle.objects.aggregate(count=Count('id'), modified=Max('object_modified'))
+            if fingerprint != self.fingerprint:
+                puzzles = list(
+                    Puzzle.objects
+                    .filter(date_active__isnull=False)
+                    .order_by('date_active', 'id')
+                    .values_list(*FIELDS)
+                )
+                self.index = (
+                    [puzzle[3] for puzzle in puzzles],
+                    puzzles,
+                    {puzzle[0]: position for position, puzzle in enumerate(puzzles)},
+                    [(puzzle[3], puzzle[0]) for puzzle in puzzles],
+                )
+                self.fingerprint = fingerprint
+            self.checked = time.monotonic()
+        return self.index
+
+    def available(self, date):
+        """
+        Returns the puzzles active on or before `date`, most recent first.
+        """
+        dates, puzzles, _, _ = self.refresh()
+        puzzles = puzzles[:bisect_right(dates, date)]
+        return [Puzzle(**dict(zip(FIELDS, puzzle))) for puzzle in reversed(puzzles)]
+
+    def current(self, date):
+        """
+        Returns the most recent puzzle active on `date`.
+        """
+        dates, puzzles, _, _ = self.refresh()
+        position = bisect_right(dates, date)
+        if not position:
+            raise Puzzle.DoesNotExist('No puzzle is active yet.')
+        return Puzzle(**dict(zip(FIELDS, puzzles[position - 1])))
+
+    def get(self, puzzle_id, date):
+        """
+        Returns the puzzle with `puzzle_id` if it's active on or before `date`.
+        """
+        dates, puzzles, by_id, _ = self.refresh()
+        position = by_id.get(puzzle_id)
+        if position is None or dates[position] > date:
+            raise Puzzle.DoesNotExist(f'Puzzle {puzzle_id} is not available.')
+        return Puzzle(**dict(zip(FIELDS, puzzles[position])))
+
+    def page(self, date, limit, before=None, since=None, cursor=None):
+        """
+        Returns up to `limit` puzzles available on `date`, most recent first,
+        and the cursor for the next page, or None if this is the last one.
+        Puzzles are ordered by (date_active, id): only those dated before `before`,
+        on or after `since` and ordered before the (date, id) `cursor` are returned.
+        """
+        dates, puzzles, _, keys = self.refresh()
+        end = bisect_right(dates, date)
+        if before is not None:
+            end = min(end, bisect_left(dates, before))
+        if cursor is not None:
+            end = min(end, bisect_left(keys, cursor))
+        first = bisect_left(dates, since) if since is not None else 0
+        start = max(first, end - limit)
+        next_cursor = keys[start] if start > first else None
+        return [Puzzle(**dict(zip(FIELDS, puzzle))) for puzzle in reversed(puzzles[start:end])], next_cursor
+
+
+puzzle_schedule = PuzzleSchedule()
+
+
+@receiver(post_save, sender=Puzzle)
+@receiver(post_delete, sender=Puzzle)
+def invalidate_puzzle_schedule(**kwargs):
+    puzzle_schedule.invalidate()
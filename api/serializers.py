@@ -1,5 +1,8 @@
+import datetime
+
 from rest_framework import serializers
-from api.models import Solution
+from api.counters import submit_solution
+from api.models import Puzzle, Solution
 
 
 class CrewMemberSerializer(serializers.Serializer):
@@ -14,18 +17,20 @@ class MovieCreditSerializer(serializers.Serializer):
     id = serializers.IntegerField()
 
 
-class PuzzleSerializer(serializers.Serializer):
-    id = serializers.IntegerField()
-    start_movie = MovieCreditSerializer()
-    end_movie = MovieCreditSerializer()
-    local_datetime = serializers.CharField(allow_null=True)
-    local_timezone = serializers.CharField()
-    author = serializers.CharField(allow_blank=True, allow_null=True)
+class HistoricalPuzzleQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=30)
+    before = serializers.DateField(required=False)
+    since = serializers.DateField(required=False)
+    cursor = serializers.CharField(required=False)
+    compact = serializers.BooleanField(default=False)
 
+    def validate_cursor(self, value):
+        try:
+            date, puzzle_id = value.split('.')
+            return datetime.date.fromisoformat(date), int(puzzle_id)
+        except ValueError:
+            raise serializers.ValidationError('Invalid cursor.')
 
-class HistoricalPuzzleSerializer(serializers.Serializer):
-    id = serializers.IntegerField()
-    datetime = serializers.CharField()
 
 class SolutionSerializer(serializers.ModelSerializer):
     solution = serializers.ListField(
@@ -33,18 +38,37 @@ class SolutionSerializer(serializers.ModelSerializer):
         child=serializers.IntegerField(label='Solution'),
     )
 
+    def validate(self, data):
+        # api.paths reads credits through api.utils, which imports this module.
+        from api.paths import PathChecker
+
+        errors = PathChecker().errors(data['puzzle'], data['solution'])
+        if errors:
+            raise serializers.ValidationError({'solution': errors})
+        return data
+
     def save(self):
         puzzle = self.validated_data['puzzle']
-        solution = self.validated_data['solution']
-        solution, _ = Solution.objects.get_or_create(
-            puzzle=puzzle,
-            solution=solution,
-        )
-        solution.count += 1
-        solution.save()
+        solution = submit_solution(puzzle, self.validated_data['solution'])
+        if solution is None:
+            raise serializers.ValidationError(
+                {'solution': ['This solution belongs to a different puzzle.']}
+            )
         return solution
 
     class Meta:
         model = Solution
         fields = ['token', 'puzzle', 'solution', 'count', 'num_degrees']
         read_only_fields = ['token', 'count', 'num_degrees']
+
+
+class SolutionValidationSerializer(serializers.Serializer):
+    puzzle = serializers.PrimaryKeyRelatedField(queryset=Puzzle.objects.all())
+    solutions = serializers.ListField(
+        allow_empty=False,
+        max_length=100,
+        child=serializers.ListField(
+            allow_empty=False,
+            child=serializers.IntegerField(label='Solution'),
+        ),
+    )
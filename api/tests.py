@@ -1,3 +1,894 @@
-from django.test import TestCase
+import datetime
+import gzip
+import itertools
+import json
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from requests import HTTPError, Response
+
+from api.cache import Memoized, TieredCache, local_tiers
+from api.counters import SolutionCounterBuffer, current_puzzle_metrics, current_solution_count
+from api.graph import GraphBuilder, get_graph, refresh_stale_nodes
+from api.helpers import BidirectionalSearch, ConcurrentExpander, Node, expand_level
+from api.models import Puzzle, Solution, SolutionLengthCount
+from api.paths import PathChecker
+from api.schedule import PuzzleSchedule, puzzle_schedule
+from api.tmdb_client import TMDBUnavailable
+from api.utils import pack_ids
+
+FILM = Node.Type.FILM
+PERSON = Node.Type.PERSON
+
+
+def random_graph(num_films=40, num_people=60, credits_per_film=4, seed=0):
+    """
+    Returns a dict of node key -> neighbour keys for a random graph of films and people.
+    """
+    rng = random.Random(seed)
+    graph = {}
+    for film_id in range(1, num_films + 1):
+        for person_id in rng.sample(range(1, num_people + 1), credits_per_film):
+            graph.setdefault((FILM, film_id), []).append((PERSON, person_id))
+            graph.setdefault((PERSON, person_id), []).append((FILM, film_id))
+    return graph
+
+
+class FakeTMDB:
+    """
+    Stands in for tmdb when expanding nodes: answers from a fixed graph after
+    `delay` seconds, or once `gate` is set, and records the requests made
+    and the most that were open at once.
+    """
+
+    def __init__(self, graph, delay=0.005, gate=None):
+        self.graph = graph
+        self.delay = delay
+        self.gate = gate
+        self.calls = Counter()
+        self.open = 0
+        self.most_open = 0
+        self.lock = threading.Lock()
+
+    def expand(self, key, graph=None):
+        with self.lock:
+            self.calls[key] += 1
+            self.open += 1
+            self.most_open = max(self.most_open, self.open)
+        if self.gate is not None:
+            self.gate.wait()
+        time.sleep(self.delay)
+        with self.lock:
+            self.open -= 1
+        return self.graph.get(key, [])
+
+    def expand_level(self, keys):
+        return {key: self.expand(key) for key in keys}
+
+
+def shortest_paths(graph, start, end):
+    """
+    Returns every shortest path from start to end, found with a plain breadth-first search.
+    """
+    depths = {start: 0}
+    predecessors = {start: []}
+    frontier = [start]
+    while frontier and end not in depths:
+        level = []
+        for key in frontier:
+            for child in graph.get(key, []):
+                if child not in depths:
+                    depths[child] = depths[key] + 1
+                    predecessors[child] = []
+                    level.append(child)
+                if depths[child] == depths[key] + 1 and key not in predecessors[child]:
+                    predecessors[child].append(key)
+        frontier = level
+    if end not in depths:
+        return []
+
+    def paths_to(key):
+        if key == start:
+            return [[start]]
+        return [path + [key] for predecessor in predecessors[key] for path in paths_to(predecessor)]
+    return paths_to(end)
+
+
+class BidirectionalSearchTests(SimpleTestCase):
+    def test_agrees_with_a_plain_breadth_first_search(self):
+        for seed, credits_per_film in itertools.product(range(5), (2, 3)):
+            # Sparse enough that some films are far apart or unreachable.
+            graph = random_graph(num_films=30, num_people=45, credits_per_film=credits_per_film, seed=seed)
+            for end_id in range(2, 31):
+                start, end = (FILM, 1), (FILM, end_id)
+                expected = shortest_paths(graph, start, end)
+                for max_depth in (2, 4, 6, 8):
+                    with self.subTest(seed=seed, end=end_id, max_depth=max_depth):
+                        search = BidirectionalSearch(start, end, max_depth, FakeTMDB(graph, delay=0).expand_level)
+                        path = search.run()
+                        if not expected or len(expected[0]) - 1 > max_depth:
+                            self.assertIsNone(path)
+                            self.assertEqual(search.num_shortest_paths, 0)
+                            self.assertEqual(search.sample_paths(5), [])
+                            continue
+                        self.assertIn(path, expected)
+                        self.assertEqual(search.num_shortest_paths, len(expected))
+                        samples = search.sample_paths(5, random.Random(seed))
+                        self.assertTrue(1 <= len(samples) <= min(5, len(expected)))
+                        self.assertEqual(len({tuple(sample) for sample in samples}), len(samples))
+                        for sample in samples:
+                            self.assertIn(sample, expected)
+
+    def test_samples_every_shortest_path_equally_often(self):
+        graph = random_graph(num_films=30, num_people=45, credits_per_film=3, seed=4)
+        start, end = max(
+            (((FILM, 1), (FILM, end_id)) for end_id in range(2, 31)),
+            key=lambda pair: len(shortest_paths(graph, *pair)),
+        )
+        expected = shortest_paths(graph, start, end)
+        self.assertGreater(len(expected), 2)
+        search = BidirectionalSearch(start, end, 8, FakeTMDB(graph, delay=0).expand_level)
+        search.run()
+        rng = random.Random(0)
+        draws = 1000 * len(expected)
+        counts = Counter(tuple(search.sample_paths(1, rng)[0]) for _ in range(draws))
+        self.assertEqual(set(counts), {tuple(path) for path in expected})
+        for count in counts.values():
+            self.assertAlmostEqual(count / draws, 1 / len(expected), delta=0.25 / len(expected))
+
+
+class ConcurrentExpanderTests(SimpleTestCase):
+    def test_finds_the_same_paths_as_expanding_one_node_at_a_time(self):
+        graph = random_graph()
+        for end_id in range(2, 41):
+            start, end = (FILM, 1), (FILM, end_id)
+            serial = BidirectionalSearch(start, end, 8, FakeTMDB(graph).expand_level)
+            with ConcurrentExpander(max_workers=8, max_connections=4, expand=FakeTMDB(graph).expand) as expander:
+                concurrent = BidirectionalSearch(start, end, 8, expander)
+                self.assertEqual(concurrent.run(), serial.run())
+            self.assertEqual(concurrent.num_shortest_paths, serial.num_shortest_paths)
+
+    def test_nodes_requested_while_in_flight_share_one_request(self):
+        gate = threading.Event()
+        fake = FakeTMDB(random_graph(), gate=gate)
+        with ConcurrentExpander(max_workers=4, max_connections=2, expand=fake.expand) as expander:
+            futures = [expander.submit((FILM, 1), None) for _ in range(5)]
+            gate.set()
+            results = [future.result() for future in futures]
+        self.assertEqual(fake.calls[FILM, 1], 1)
+        self.assertEqual(results, [fake.graph[FILM, 1]] * 5)
+
+    def test_requests_open_at_once_are_bounded(self):
+        fake = FakeTMDB(random_graph())
+        keys = [(FILM, film_id) for film_id in range(1, 41)]
+        with ConcurrentExpander(max_workers=16, max_connections=3, expand=fake.expand) as expander:
+            neighbours = expander(keys)
+        self.assertEqual(neighbours, fake.expand_level(keys))
+        self.assertLessEqual(fake.most_open, 3)
+
+    def test_a_remembering_expander_expands_each_node_once(self):
+        graph = random_graph()
+        fake = FakeTMDB(graph, delay=0)
+        with ConcurrentExpander(max_workers=4, expand=fake.expand, remember=True) as expander:
+            for end_id in range(2, 41):
+                BidirectionalSearch((FILM, 1), (FILM, end_id), 8, expander).run()
+        self.assertTrue(fake.calls)
+        self.assertEqual(set(fake.calls.values()), {1})
+
+    def test_failed_expansions_are_not_remembered(self):
+        attempts = Counter()
+
+        def expand(key, graph):
+            attempts[key] += 1
+            if attempts[key] == 1:
+                raise ConnectionError('tmdb is down')
+            return [(PERSON, 1)]
+
+        with ConcurrentExpander(max_workers=2, expand=expand, remember=True) as expander:
+            with self.assertRaises(ConnectionError):
+                expander([(FILM, 1)])
+            self.assertEqual(expander([(FILM, 1)]), {(FILM, 1): [(PERSON, 1)]})
+            self.assertEqual(expander([(FILM, 1)]), {(FILM, 1): [(PERSON, 1)]})
+        self.assertEqual(attempts[FILM, 1], 2)
+
+    def test_the_graph_store_is_looked_up_once_per_level(self):
+        fake = FakeTMDB(random_graph(), delay=0)
+        keys = [(FILM, film_id) for film_id in range(1, 41)]
+        with mock.patch('api.helpers.get_graph', return_value=None) as graph:
+            with ConcurrentExpander(max_workers=4, expand=fake.expand) as expander:
+                expander(keys)
+        graph.assert_called_once()
+
+        with mock.patch('api.helpers.get_graph', return_value=None) as graph, \
+                mock.patch('api.helpers.film_neighbours', return_value=[]):
+            expand_level(keys)
+        graph.assert_called_once()
+
+
+class GraphStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path, ignore_errors=True)
+        graph_store = self.settings(GRAPH_STORE_PATH=self.path)
+        graph_store.enable()
+        self.addCleanup(graph_store.disable)
+
+    def person(self, person_id, popularity):
+        return {'id': person_id, 'name': f'Person {person_id}', 'popularity': popularity}
+
+    def versions(self):
+        return sorted(child.name for child in get_graph().directory.parent.iterdir() if child.name.isdigit())
+
+    def test_refreshing_replaces_only_the_credits_of_stale_nodes(self):
+        now = int(time.time())
+        builder = GraphBuilder()
+        builder.add_movie_credits(
+            {'id': 1, 'title': 'Stale', 'popularity': 10},
+            {'cast': [self.person(7, 5), self.person(8, 3)]},
+            refreshed=now - settings.GRAPH_STALE_AFTER_IN_SECONDS - 60,
+        )
+        builder.add_movie_credits(
+            {'id': 2, 'title': 'Fresh', 'popularity': 10},
+            {'cast': [self.person(8, 3)], 'crew': [dict(self.person(7, 5), job='Director')]},
+            refreshed=now,
+        )
+        first = builder.build()
+        self.assertIsNone(first.movie_neighbours(1))
+        fresh_before = [column.tolist() for column in first.movie_neighbours(2)]
+
+        fetched = []
+
+        def fetch_movie_credits(movie_id):
+            fetched.append(movie_id)
+            return {'cast': [self.person(9, 4), self.person(7, 5)]}
+
+        def fetch_person_credits(person_id):
+            raise AssertionError('No person was stale')
+
+        second, refreshed = refresh_stale_nodes(fetch_movie_credits, fetch_person_credits)
+        self.assertEqual((fetched, refreshed), ([1], 1))
+        self.assertEqual(get_graph().version, second.version)
+        self.assertEqual(second.meta('movie', second.index('movie', 1))['title'], 'Stale')
+        self.assertEqual(second.movie_neighbours(1)[0].tolist(), [7, 9])
+        self.assertFalse(second.has_credit(1, 8))
+        self.assertEqual([column.tolist() for column in second.movie_neighbours(2)], fresh_before)
+        self.assertEqual(self.versions(), [first.version, second.version])
+
+        # Nothing is stale any more, so only the version rotates.
+        third, refreshed = refresh_stale_nodes(fetch_movie_credits, fetch_person_credits)
+        self.assertEqual((fetched, refreshed), ([1], 0))
+        self.assertEqual(third.movie_neighbours(1)[0].tolist(), [7, 9])
+        self.assertEqual(self.versions(), [second.version, third.version])
+
+
+
+class IngestTMDBDumpTests(SimpleTestCase):
+    movies = [
+        {'id': 1, 'title': 'One', 'popularity': 20},
+        {'id': 2, 'original_title': 'Two', 'popularity': 10},
+        {'id': 3, 'title': 'Three', 'popularity': 8},
+        {'id': 4, 'title': 'Unpopular', 'popularity': 2},
+    ]
+    people = [
+        {'id': 10, 'name': 'Ten', 'popularity': 9},
+        {'id': 11, 'name': 'Eleven', 'popularity': 3},
+        {'id': 12, 'name': 'Unpopular', 'popularity': 1},
+        {'id': 13, 'name': 'Thirteen', 'popularity': 5},
+        {'id': 14, 'name': 'Uncredited', 'popularity': 4},
+    ]
+    credits = [
+        {
+            'id': 1,
+            'cast': [
+                {'id': 10, 'popularity': 9},
+                {'id': 11, 'popularity': 3},
+                {'id': 12, 'popularity': 1},
+                {'id': 10, 'popularity': 9},
+            ],
+            'crew': [
+                {'id': 13, 'popularity': 5, 'job': 'Director'},
+                {'id': 11, 'popularity': 3, 'job': 'Caterer'},
+            ],
+        },
+        {
+            'id': 2,
+            'cast': [{'id': 11, 'popularity': 3}],
+            'crew': [
+                {'id': 10, 'popularity': 9, 'job': 'Writer'},
+                {'id': 10, 'popularity': 9, 'job': 'Producer'},
+            ],
+        },
+        # Film 4 is too unpopular to be in the store, so its credits are dropped.
+        {'id': 4, 'cast': [{'id': 10, 'popularity': 9}]},
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        graph_store = self.settings(GRAPH_STORE_PATH=os.path.join(self.directory, 'graph'))
+        graph_store.enable()
+        self.addCleanup(graph_store.disable)
+
+    def write_dump(self, name, records):
+        path = os.path.join(self.directory, f'{name}.json.gz')
+        with gzip.open(path, 'wt', encoding='utf-8') as dump:
+            for record in records:
+                dump.write(json.dumps(record) + '\n')
+        return path
+
+    def ingest(self):
+        call_command(
+            'ingest_tmdb_dump',
+            movies=self.write_dump('movies', self.movies),
+            people=self.write_dump('people', self.people),
+            credits=self.write_dump('credits', self.credits),
+            stdout=StringIO(),
+        )
+        return get_graph()
+
+    def neighbours(self, graph, name, node_id):
+        ids, _, jobs = graph.neighbours(name, node_id)
+        return [(node_id, graph.jobs[job]) for node_id, job in zip(ids.tolist(), jobs.tolist())]
+
+    def assert_ingested(self, graph):
+        self.assertEqual(graph.movie_ids.tolist(), [1, 2, 3])
+        self.assertEqual(graph.person_ids.tolist(), [10, 11, 13, 14])
+        self.assertEqual(graph.meta('movie', graph.index('movie', 2))['title'], 'Two')
+        self.assertEqual(graph.jobs, ['Cast', 'Director', 'Writer', 'Producer'])
+
+        # Only films with a credits record and the people credited in one are complete.
+        self.assertEqual([graph.is_fresh('movie', movie_id) for movie_id in (1, 2, 3)], [True, True, False])
+        self.assertEqual([graph.is_fresh('person', person_id) for person_id in (10, 11, 13, 14)], [True, True, True, False])
+        self.assertIsNone(graph.movie_neighbours(3))
+
+        # Most popular first, without the unpopular person, the unsafe job or the duplicate.
+        self.assertEqual(self.neighbours(graph, 'movie', 1), [(10, 'Cast'), (13, 'Director'), (11, 'Cast')])
+        self.assertEqual(self.neighbours(graph, 'movie', 2), [(10, 'Writer'), (10, 'Producer'), (11, 'Cast')])
+        self.assertEqual(self.neighbours(graph, 'person', 10), [(1, 'Cast'), (2, 'Writer'), (2, 'Producer')])
+        self.assertEqual(self.neighbours(graph, 'person', 11), [(1, 'Cast'), (2, 'Cast')])
+
+    def test_ingests_the_useful_credits_of_popular_films(self):
+        self.assert_ingested(self.ingest())
+
+    def test_ingests_the_same_in_small_batches(self):
+        with mock.patch('api.graph.EDGE_BATCH_SIZE', 2):
+            self.assert_ingested(self.ingest())
+
+
+class FakeClock:
+    """
+    Stands in for the time module, only moving when told to.
+    """
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        test_caches = self.settings(CACHES={
+            **settings.CACHES,
+            'tiered-shared': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'tiered-shared',
+            },
+        })
+        test_caches.enable()
+        self.addCleanup(test_caches.disable)
+        self.addCleanup(local_tiers.pop, 'tiered-shared', None)
+        self.clock = FakeClock()
+        clock = mock.patch('api.cache.time', self.clock)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def tiered_cache(self, **options):
+        local_tiers.pop('tiered-shared', None)
+        cache = TieredCache('tiered-shared', {'OPTIONS': {'LOCAL_TIMEOUT': 60, **options}})
+        cache.shared.clear()
+        return cache
+
+    def local_keys(self, cache):
+        return [key.split(':')[-1] for key in cache.tier.local]
+
+    def test_evicts_the_least_recently_used_beyond_max_entries(self):
+        cache = self.tiered_cache(MAX_ENTRIES=3)
+        for key in 'abc':
+            cache.set(key, key)
+        cache.get('a')
+        cache.set('d', 'd')
+        self.assertEqual(self.local_keys(cache), ['c', 'a', 'd'])
+        # Evicted values are still shared.
+        self.assertEqual(cache.get('b'), 'b')
+        self.assertEqual(self.local_keys(cache), ['a', 'd', 'b'])
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+    def test_evicts_the_least_recently_used_beyond_max_size(self):
+        value = 'x' * 100
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        cache = self.tiered_cache(MAX_SIZE=size * 2)
+        for key in 'abc':
+            cache.set(key, value)
+        self.assertEqual(self.local_keys(cache), ['b', 'c'])
+        self.assertEqual(cache.stats()['size'], size * 2)
+
+        # Values too big for the local tier are only shared.
+        cache.set('big', 'x' * size * 2)
+        self.assertEqual(self.local_keys(cache), ['b', 'c'])
+        self.assertEqual(cache.get('big'), 'x' * size * 2)
+
+    def test_local_values_expire_after_the_local_timeout(self):
+        cache = self.tiered_cache()
+        cache.set('key', 'old')
+        cache.shared.set('key', 'new')
+        self.clock.advance(59)
+        self.assertEqual(cache.get('key'), 'old')
+        self.clock.advance(2)
+        self.assertEqual(cache.get('key'), 'new')
+
+        # Nor are values kept locally past their own timeout.
+        cache.set('short', 'old', timeout=5)
+        cache.shared.set('short', 'new')
+        self.clock.advance(6)
+        self.assertEqual(cache.get('short'), 'new')
+
+    def test_stats_count_hits_misses_and_evictions(self):
+        cache = self.tiered_cache(MAX_ENTRIES=1)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.shared.set('b', 2)
+        cache.get('b')
+        cache.get('a')
+        cache.get('missing')
+        self.assertEqual(cache.stats(), {
+            'local_hits': 1,
+            'shared_hits': 2,
+            'misses': 1,
+            'evictions': 2,
+            'entries': 1,
+            'size': len(pickle.dumps(1, pickle.HIGHEST_PROTOCOL)),
+        })
+
+    def test_many_key_operations_keep_both_tiers_consistent(self):
+        cache = self.tiered_cache()
+        self.assertEqual(cache.set_many({'a': 1, 'b': 2}), [])
+        self.assertEqual(cache.shared.get_many(['a', 'b']), {'a': 1, 'b': 2})
+        self.assertEqual(self.local_keys(cache), ['a', 'b'])
+
+        cache.shared.set('c', 3)
+        self.assertEqual(cache.get_many(['a', 'b', 'c', 'd']), {'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(self.local_keys(cache), ['a', 'b', 'c'])
+
+        cache.delete('a')
+        cache.delete_many(['b'])
+        self.assertEqual(self.local_keys(cache), ['c'])
+        self.assertEqual(cache.shared.get_many(['a', 'b', 'c']), {'c': 3})
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), {'c': 3})
+
+    def test_instances_share_one_local_tier_per_location(self):
+        cache = self.tiered_cache()
+        cache.set('key', 'value')
+        other = TieredCache('tiered-shared', {})
+        self.assertIs(other.tier, cache.tier)
+        cache.shared.delete('key')
+        self.assertEqual(other.get('key'), 'value')
+
+
+class MemoizedTests(SimpleTestCase):
+    def setUp(self):
+        test_caches = self.settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'memoized',
+            },
+        })
+        test_caches.enable()
+        self.addCleanup(test_caches.disable)
+        caches['default'].clear()
+        self.clock = FakeClock()
+        clock = mock.patch('api.cache.time', self.clock)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+        self.calls = 0
+        self.results = ['old']
+        self.gate = threading.Event()
+        self.gate.set()
+        self.memoized = Memoized(self.lookup, 10, lambda movie_id: f'test:{movie_id}', hard_timeout=100)
+
+    def lookup(self, movie_id):
+        self.calls += 1
+        self.gate.wait()
+        result = self.results[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def wait_until_cached(self, value):
+        deadline = time.time() + 5
+        while caches['default'].get('test:1')[0] != value:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_soft_expired_results_are_returned_while_one_refresh_runs(self):
+        self.assertEqual(self.memoized(1), 'old')
+        self.clock.advance(20)
+        self.results = ['new']
+        self.gate.clear()
+        self.assertEqual([self.memoized(1) for _ in range(5)], ['old'] * 5)
+        self.gate.set()
+        self.wait_until_cached('new')
+        self.assertEqual(self.memoized(1), 'new')
+        self.assertEqual(self.calls, 2)
+
+    def test_hard_expired_results_are_waited_for_one_call_at_a_time(self):
+        self.memoized(1)
+        self.clock.advance(200)
+        self.results = ['new']
+        self.gate.clear()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.memoized(1))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.assertEqual(results, [])
+        self.gate.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['new'] * 5)
+        self.assertEqual(self.calls, 2)
+
+    def test_stale_results_are_served_while_tmdb_is_unavailable(self):
+        self.memoized(1)
+        self.clock.advance(200)
+        self.results = [TMDBUnavailable()]
+        self.assertEqual(self.memoized(1), 'old')
+        self.assertEqual(self.calls, 2)
+
+        # Other failures, or nothing cached to fall back on, are raised.
+        self.results = [ValueError()]
+        with self.assertRaises(ValueError):
+            self.memoized(1)
+        self.results = [TMDBUnavailable()]
+        with self.assertRaises(TMDBUnavailable):
+            self.memoized(2)
+
+
+class HistoricalPuzzlesPageTests(TestCase):
+    def setUp(self):
+        test_caches = self.settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'historical',
+            },
+        })
+        test_caches.enable()
+        self.addCleanup(test_caches.disable)
+        # Rolling the test back deletes puzzles without telling the schedule.
+        self.addCleanup(puzzle_schedule.invalidate)
+
+        self.today = timezone.localdate()
+        self.first = self.today - datetime.timedelta(days=30)
+        self.dates = [self.first + datetime.timedelta(days=day) for day in (0, 0, 1, 2, 2, 3)]
+        self.puzzles = [
+            Puzzle.objects.create(start_movie_id=1, end_movie_id=2, date_active=date)
+            for date in self.dates
+        ]
+        # Not available yet.
+        Puzzle.objects.create(start_movie_id=1, end_movie_id=2, date_active=self.today + datetime.timedelta(days=10))
+        self.newest_first = [puzzle.id for puzzle in reversed(self.puzzles)]
+        self.schedule = PuzzleSchedule()
+
+    def key(self, index):
+        return self.dates[index], self.puzzles[index].id
+
+    def page(self, limit, **kwargs):
+        puzzles, next_cursor = self.schedule.page(self.today, limit, **kwargs)
+        return [puzzle.id for puzzle in puzzles], next_cursor
+
+    def test_pages_end_with_no_next_cursor(self):
+        self.assertEqual(self.page(6), (self.newest_first, None))
+        self.assertEqual(self.page(100), (self.newest_first, None))
+        self.assertEqual(self.page(5), (self.newest_first[:5], self.key(1)))
+        self.assertEqual(self.page(5, cursor=self.key(1)), (self.newest_first[5:], None))
+
+    def test_following_cursors_lists_every_puzzle_once(self):
+        ids, cursor = self.page(1)
+        while cursor:
+            page, cursor = self.page(1, cursor=cursor)
+            self.assertEqual(len(page), 1)
+            ids += page
+        self.assertEqual(ids, self.newest_first)
+
+    def test_puzzles_on_the_same_date_are_ordered_by_id(self):
+        self.assertEqual(self.page(2, before=self.dates[5]), ([self.puzzles[4].id, self.puzzles[3].id], self.key(3)))
+        self.assertEqual(self.page(2, cursor=self.key(4)), ([self.puzzles[3].id, self.puzzles[2].id], self.key(2)))
+
+    def test_before_and_since_bound_the_cursor(self):
+        self.assertEqual(self.page(30, before=self.dates[2]), (self.newest_first[4:], None))
+        self.assertEqual(self.page(30, since=self.dates[3]), (self.newest_first[:3], None))
+        bounds = {'before': self.dates[5], 'since': self.dates[2]}
+        self.assertEqual(self.page(2, **bounds), (self.newest_first[1:3], self.key(3)))
+        self.assertEqual(self.page(2, cursor=self.key(3), **bounds), (self.newest_first[3:4], None))
+        self.assertEqual(self.page(2, cursor=self.key(0), **bounds), ([], None))
+
+    def get(self, query):
+        return self.client.get(f'/api/puzzle/historical/{query}')
+
+    def test_api_pages_follow_the_next_cursor(self):
+        response = self.get('?limit=4')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([puzzle['id'] for puzzle in response.json()['results']], self.newest_first[:4])
+        self.assertEqual(response.json()['next'], f'{self.dates[2].isoformat()}.{self.puzzles[2].id}')
+
+        response = self.get(f'?limit=4&cursor={response.json()["next"]}&compact=true')
+        self.assertEqual(response.json(), {
+            'ids': self.newest_first[4:],
+            'dates': [self.dates[1].isoformat(), self.dates[0].isoformat()],
+            'next': None,
+        })
+
+    def test_api_limits_are_bounded(self):
+        self.assertEqual(len(self.get('?limit=1').json()['results']), 1)
+        self.assertEqual(len(self.get('?limit=100').json()['results']), 6)
+        self.assertEqual(self.get('?limit=0').status_code, 400)
+        self.assertEqual(self.get('?limit=101').status_code, 400)
+
+    def test_api_rejects_malformed_cursors(self):
+        for cursor in ('nonsense', '2022-01-01', '2022-13-01.1', '2022-01-01.x'):
+            with self.subTest(cursor=cursor):
+                response = self.get(f'?cursor={cursor}')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('cursor', response.json())
+
+    def test_api_lists_every_puzzle_without_pagination_parameters(self):
+        for query in ('', '?_=1'):
+            with self.subTest(query=query):
+                response = self.get(query)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([puzzle['id'] for puzzle in response.json()], self.newest_first)
+
+
+class StubCredits:
+    """
+    Stands in for the credit id lookups, with a 404 for ids tmdb doesn't know
+    and a count of the lookups made.
+    """
+
+    movie_credits = {1: [10, 11], 2: [10], 3: [11]}
+    # Person 12 is only in the films' credits by their own filmography.
+    person_credits = {10: [1, 2], 11: [1, 3], 12: [2, 3]}
+
+    def setUp(self):
+        self.lookups = Counter()
+        for name, credits in (
+            ('get_movie_credit_ids', self.movie_credits),
+            ('get_person_credit_ids', self.person_credits),
+        ):
+            stub = mock.patch(f'api.paths.{name}', self.stub(name, credits))
+            stub.start()
+            self.addCleanup(stub.stop)
+        graph = mock.patch('api.paths.get_graph', return_value=None)
+        graph.start()
+        self.addCleanup(graph.stop)
+
+    def stub(self, name, credits):
+        def get_credit_ids(node_id):
+            self.lookups[name, node_id] += 1
+            if node_id not in credits:
+                response = Response()
+                response.status_code = 404
+                raise HTTPError(response=response)
+            return pack_ids(credits[node_id])
+        return get_credit_ids
+
+
+class PathCheckerTests(StubCredits, SimpleTestCase):
+    puzzle = Puzzle(id=1, start_movie_id=1, end_movie_id=2)
+
+    def errors(self, solution):
+        return PathChecker().errors(self.puzzle, solution)
+
+    def test_valid_paths_have_no_errors(self):
+        self.assertEqual(self.errors([1, 10, 2]), [])
+        self.assertEqual(self.errors([1, 11, 3, 12, 2]), [])
+
+    def test_paths_must_join_the_puzzle_films(self):
+        self.assertEqual(self.errors([3, 11, 2]), ['A solution must start with film 1.'])
+        self.assertEqual(self.errors([1, 11, 3]), ['A solution must end with film 2.'])
+        self.assertEqual(self.errors([3, 11, 1]), [
+            'A solution must start with film 1.',
+            'A solution must end with film 2.',
+        ])
+
+    def test_paths_must_alternate_films_and_people(self):
+        for solution in ([1], [1, 10], [1, 10, 2, 10]):
+            with self.subTest(solution=solution):
+                self.assertEqual(self.errors(solution), [
+                    'A solution alternates between films and people, starting and ending with a film.'
+                ])
+
+    def test_people_must_be_credited_on_both_films(self):
+        self.assertEqual(self.errors([1, 12, 2]), ['Person 12 is not credited on film 1.'])
+        self.assertEqual(self.errors([1, 11, 2]), ['Person 11 is not credited on film 2.'])
+
+    def test_unknown_ids_have_no_credits(self):
+        self.assertEqual(self.errors([1, 10, 99, 10, 2]), [
+            'Person 10 is not credited on film 99.',
+            'Person 10 is not credited on film 99.',
+        ])
+        self.assertEqual(self.errors([1, 98, 2]), [
+            'Person 98 is not credited on film 1.',
+            'Person 98 is not credited on film 2.',
+        ])
+
+    def test_other_tmdb_errors_are_raised(self):
+        response = Response()
+        response.status_code = 500
+        with mock.patch('api.paths.get_movie_credit_ids', side_effect=HTTPError(response=response)):
+            with self.assertRaises(HTTPError):
+                self.errors([1, 12, 2])
+
+    def test_credit_lists_are_looked_up_once_per_check(self):
+        self.errors([1, 12, 3, 12, 2])
+        self.assertEqual(set(self.lookups.values()), {1})
+
+
+class SolutionValidationTests(StubCredits, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.puzzle = Puzzle.objects.create(start_movie_id=1, end_movie_id=2)
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type='application/json')
+
+    def test_validate_checks_every_path_without_saving(self):
+        response = self.post('/api/solution/validate/', {
+            'puzzle': self.puzzle.id,
+            'solutions': [[1, 10, 2], [1, 12, 2], [3, 11, 2]],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'puzzle': self.puzzle.id,
+            'results': [
+                {'valid': True, 'errors': []},
+                {'valid': False, 'errors': ['Person 12 is not credited on film 1.']},
+                {'valid': False, 'errors': ['A solution must start with film 1.']},
+            ],
+        })
+        self.assertFalse(Solution.objects.exists())
+
+    def test_validate_rejects_unknown_puzzles(self):
+        response = self.post('/api/solution/validate/', {'puzzle': self.puzzle.id + 1, 'solutions': [[1, 10, 2]]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_solutions_are_rejected_before_being_submitted(self):
+        with mock.patch('api.serializers.submit_solution') as submit:
+            response = self.post('/api/solution/', {'puzzle': self.puzzle.id, 'solution': [1, 12, 2]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'solution': ['Person 12 is not credited on film 1.']})
+        submit.assert_not_called()
+
+    def test_valid_solutions_are_submitted(self):
+        with self.settings(SOLUTION_WRITE_BEHIND=False):
+            response = self.post('/api/solution/', {'puzzle': self.puzzle.id, 'solution': [1, 10, 2]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['solution'], [1, 10, 2])
+        self.assertEqual(Solution.objects.get(token=response.json()['token']).count, 1)
+
+class SolutionSubmitTests(TransactionTestCase):
+    def test_concurrent_submissions_are_all_counted(self):
+        puzzle = Puzzle.objects.create(start_movie_id=1, end_movie_id=2)
+        paths = [[1, 10, 2], [1, 11, 2], [1, 12, 3, 13, 2]]
+        num_threads, per_thread = 20, 25
+        barrier = threading.Barrier(num_threads)
+        submitted = Counter()
+        errors = []
+        lock = threading.Lock()
+
+        def submit(thread_index):
+            try:
+                barrier.wait()
+                for index in range(per_thread):
+                    path = paths[(thread_index + index) % len(paths)]
+                    Solution.submit(puzzle, path)
+                    with lock:
+                        submitted[tuple(path)] += 1
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit, args=(index, )) for index in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        counts = {tuple(path): count for path, count in Solution.objects.values_list('solution', 'count')}
+        self.assertEqual(counts, dict(submitted))
+        self.assertEqual(
+            list(SolutionLengthCount.objects.filter(puzzle=puzzle).order_by('steps').values_list('steps', 'plays', 'solutions')),
+            [
+                (2, submitted[1, 10, 2] + submitted[1, 11, 2], 2),
+                (4, submitted[1, 12, 3, 13, 2], 1),
+            ],
+        )
+        self.assertEqual(sum(counts.values()), num_threads * per_thread)
+
+
+class SolutionCounterBufferTests(TestCase):
+    def setUp(self):
+        self.buffer = SolutionCounterBuffer(interval=3600)
+        self.addCleanup(self.buffer.stopped.set)
+        counter = mock.patch('api.counters.solution_counter', self.buffer)
+        counter.start()
+        self.addCleanup(counter.stop)
+        self.puzzle = Puzzle.objects.create(start_movie_id=1, end_movie_id=2)
+
+    def plays(self):
+        return dict(SolutionLengthCount.objects.filter(puzzle=self.puzzle).values_list('steps', 'plays'))
+
+    def test_repeat_submissions_are_counted_when_flushed(self):
+        first = self.buffer.submit(self.puzzle, [1, 10, 2])
+        repeats = [self.buffer.submit(self.puzzle, [1, 10, 2]) for _ in range(3)]
+        self.assertEqual({solution.token for solution in repeats}, {first.token})
+
+        # Only the first submission is written straight away.
+        solution = Solution.objects.get(id=first.id)
+        self.assertEqual(solution.count, 1)
+        self.assertEqual(self.plays(), {2: 1})
+        self.assertEqual(self.buffer.pending_count(first.id), 3)
+        self.assertEqual(dict(self.buffer.pending_histogram(self.puzzle.id)), {2: 3})
+        self.assertEqual(current_solution_count(solution), 4)
+        self.assertEqual(current_puzzle_metrics(self.puzzle).num_solved, 4)
+
+        self.buffer.flush()
+        solution.refresh_from_db()
+        self.assertEqual(solution.count, 4)
+        self.assertEqual(self.plays(), {2: 4})
+        self.assertEqual(self.buffer.pending_count(first.id), 0)
+        self.assertEqual(current_solution_count(solution), 4)
+        self.assertEqual(current_puzzle_metrics(self.puzzle).num_solved, 4)
+
+    def test_deleted_solutions_are_forgotten_when_flushed(self):
+        first = self.buffer.submit(self.puzzle, [1, 10, 2])
+        self.buffer.submit(self.puzzle, [1, 10, 2])
+        Solution.objects.filter(id=first.id).delete()
+        self.buffer.flush()
+
+        resubmitted = self.buffer.submit(self.puzzle, [1, 10, 2])
+        self.assertNotEqual(resubmitted.id, first.id)
+        self.assertEqual(Solution.objects.get(id=resubmitted.id).count, 1)
+
+    def test_moved_solutions_are_forgotten_when_flushed(self):
+        first = self.buffer.submit(self.puzzle, [1, 10, 2])
+        self.buffer.submit(self.puzzle, [1, 10, 2])
+        other = Puzzle.objects.create(start_movie_id=1, end_movie_id=2)
+        Solution.objects.filter(id=first.id).update(puzzle=other)
+        self.buffer.flush()
+
+        # The pending submission isn't counted against the other puzzle.
+        self.assertEqual(Solution.objects.get(id=first.id).count, 1)
+        # The path is the other puzzle's solution now, so it can't be submitted here.
+        self.assertIsNone(self.buffer.submit(self.puzzle, [1, 10, 2]))
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+TMDB_URL = 'https://api.themoviedb.org/3'
+
+# Responses worth trying again, TMDB returns 429 when rate limiting.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TMDBUnavailable(Exception):
+    """
+    Raised instead of calling TMDB while the circuit breaker is open.
+    """
+
+
+def is_transient(exc):
+    """
+    Whether a failure is TMDB being unhealthy rather than a bad request.
+    """
+    if isinstance(exc, TMDBUnavailable):
+        return True
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code in RETRY_STATUSES
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUSES
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout, httpx.TransportError))
+
+
+class CircuitBreaker:
+    """
+    Stops calls to TMDB after `failure_threshold` failures in a row.
+    After `reset_timeout` seconds one call is let through to test the water,
+    and the breaker closes again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let this call through and hold the rest until it's done.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning('TMDB circuit breaker opened')
+                self.opened_at = time.monotonic()
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Exponential backoff with full jitter, or TMDB's Retry-After if it gave one.
+    """
+    if retry_after:
+        try:
+            return min(float(retry_after), settings.TMDB_MAX_BACKOFF_IN_SECONDS)
+        except ValueError:
+            pass
+    ceiling = min(settings.TMDB_BACKOFF_IN_SECONDS * 2 ** attempt, settings.TMDB_MAX_BACKOFF_IN_SECONDS)
+    return random.uniform(0, ceiling)
+
+
+class TMDBClient:
+    """
+    TMDB client sharing one pool of keep-alive connections,
+    with timeouts, retries with jittered backoff on 429s and 5xxs,
+    and a circuit breaker. Raises requests' HTTPError like tmdbsimple did,
+    or TMDBUnavailable while the breaker is open.
+    """
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.TMDB_MAX_CONNECTIONS,
+        )
+        self.session.mount('https://', adapter)
+
+    def get(self, path, **params):
+        if not self.breaker.allow():
+            raise TMDBUnavailable(path)
+
+        params['api_key'] = settings.TMDB_API_KEY
+        for attempt in range(settings.TMDB_RETRIES + 1):
+            retry_after = None
+            try:
+                response = self.session.get(
+                    TMDB_URL + path,
+                    params=params,
+                    timeout=settings.TMDB_TIMEOUT_IN_SECONDS,
+                )
+                response.raise_for_status()
+                self.breaker.record_success()
+                return response.json()
+            except requests.RequestException as exc:
+                if not is_transient(exc):
+                    # TMDB answered, it just didn't like the question.
+                    self.breaker.record_success()
+                    raise
+                error = exc
+                if exc.response is not None:
+                    retry_after = exc.response.headers.get('Retry-After')
+            if attempt < settings.TMDB_RETRIES:
+                time.sleep(backoff_delay(attempt, retry_after))
+
+        self.breaker.record_failure()
+        raise error
+
+    def movie_info(self, movie_id):
+        return self.get(f'/movie/{movie_id}')
+
+    def movie_credits(self, movie_id):
+        return self.get(f'/movie/{movie_id}/credits')
+
+    def person_info(self, person_id):
+        return self.get(f'/person/{person_id}')
+
+    def person_movie_credits(self, person_id):
+        return self.get(f'/person/{person_id}/movie_credits')
+
+
+class AsyncTMDBClient:
+    """
+    asyncio version of TMDBClient for async views, sharing its circuit breaker.
+    Raises httpx's HTTPStatusError.
+    """
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        connect_timeout, read_timeout = settings.TMDB_TIMEOUT_IN_SECONDS
+        self.client = httpx.AsyncClient(
+            base_url=TMDB_URL,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=settings.TMDB_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.TMDB_MAX_CONNECTIONS,
+            ),
+        )
+
+    async def get(self, path, **params):
+        if not self.breaker.allow():
+            raise TMDBUnavailable(path)
+
+        params['api_key'] = settings.TMDB_API_KEY
+        for attempt in range(settings.TMDB_RETRIES + 1):
+            retry_after = None
+            try:
+                response = await self.client.get(path, params=params)
+                response.raise_for_status()
+                self.breaker.record_success()
+                return response.json()
+            except httpx.HTTPError as exc:
+                if not is_transient(exc):
+                    self.breaker.record_success()
+                    raise
+                error = exc
+                if isinstance(exc, httpx.HTTPStatusError):
+                    retry_after = exc.response.headers.get('Retry-After')
+            if attempt < settings.TMDB_RETRIES:
+                await asyncio.sleep(backoff_delay(attempt, retry_after))
+
+        self.breaker.record_failure()
+        raise error
+
+    async def movie_info(self, movie_id):
+        return await self.get(f'/movie/{movie_id}')
+
+    async def movie_credits(self, movie_id):
+        return await self.get(f'/movie/{movie_id}/credits')
+
+    async def person_info(self, person_id):
+        return await self.get(f'/person/{person_id}')
+
+    async def person_movie_credits(self, person_id):
+        return await self.get(f'/person/{person_id}/movie_credits')
+
+
+breaker = None
+client = None
+async_clients = weakref.WeakKeyDictionary()
+clients_pid = None
+clients_lock = threading.Lock()
+
+
+def reset_after_fork():
+    """
+    Connections can't be shared with a parent process, so each process makes its own clients.
+    """
+    global breaker, client, async_clients, clients_pid
+    if clients_pid != os.getpid():
+        breaker = CircuitBreaker(
+            settings.TMDB_BREAKER_FAILURES,
+            settings.TMDB_BREAKER_RESET_IN_SECONDS,
+        )
+        client = None
+        async_clients = weakref.WeakKeyDictionary()
+        clients_pid = os.getpid()
+
+
+def get_client():
+    global client
+    with clients_lock:
+        reset_after_fork()
+        if client is None:
+            client = TMDBClient(breaker)
+        return client
+
+
+def get_async_client():
+    """
+    Returns the AsyncTMDBClient for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    with clients_lock:
+        reset_after_fork()
+        if loop not in async_clients:
+            async_clients[loop] = AsyncTMDBClient(breaker)
+        return async_clients[loop]
@@ -2,17 +2,19 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
-    path(r'movie/<int:movie_id>/', views.MovieInfoAPI.as_view()),
-    path(r'movie/<int:movie_id>/crew/', views.MovieCrewAPI.as_view()),
-    path(r'person/<int:person_id>/', views.PersonInfoAPI.as_view()),
-    path(r'person/<int:person_id>/filmography/',
-         views.FilmographyAPI.as_view()),
+    path(r'movie/<int:movie_id>/', views.movie_info),
+    path(r'movie/<int:movie_id>/crew/', views.movie_crew),
+    path(r'person/<int:person_id>/', views.person_info),
+    path(r'person/<int:person_id>/filmography/', views.filmography),
     path(r'puzzle/', views.PuzzleAPI.as_view()),
     path(r'puzzle/historical/', views.HistoricalPuzzleAPI.as_view()),
     path(r'puzzle/<int:puzzle_id>/', views.PuzzleAPI.as_view()),
     path(r'solution/', views.SolutionAPI.as_view()),
+    path(r'solution/validate/', views.SolutionValidationAPI.as_view()),
     path(r'solution/<str:token>/', views.SolutionAPI.as_view()),
     path(r'metrics/puzzle/', views.PuzzleMetricsAPI.as_view()),
     path(r'metrics/puzzle/<int:puzzle_id>/', views.PuzzleMetricsAPI.as_view()),
+    path(r'metrics/puzzle/paths/', views.PuzzlePathsMetricsAPI.as_view()),
+    path(r'metrics/puzzle/<int:puzzle_id>/paths/', views.PuzzlePathsMetricsAPI.as_view()),
     path(r'metrics/solution/<str:token>/', views.SolutionMetricsAPI.as_view()),
 ]
@@ -1,207 +1,440 @@
+import functools
+import hashlib
+from array import array
+from bisect import bisect_left
 import logging
 import toolz
 import datetime
 import pytz
 
-import tmdbsimple as tmdb
-from requests.exceptions import HTTPError
+import httpx
+from requests.exceptions import HTTPError, RequestException
 from django.conf import settings
+from django.core.cache import caches
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.gis.geoip2 import GeoIP2
-from django.db import models
 
-from cache_memoize import cache_memoize as cache
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.views import exception_handler
 from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 
-from api.models import Puzzle, Solution
-from api.serializers import CrewMemberSerializer, HistoricalPuzzleSerializer, MovieCreditSerializer, PuzzleSerializer
+from api.cache import call_many, memoize, prime_cache
+from api.counters import current_puzzle_metrics, current_solution_count
+from api.models import ArrayLength, Solution
+from api.schedule import puzzle_schedule
+from api.serializers import (
+    CrewMemberSerializer,
+    HistoricalPuzzleQuerySerializer,
+    MovieCreditSerializer,
+    SolutionValidationSerializer,
+)
+from api.tmdb_client import TMDBUnavailable, get_async_client, get_client
 from degreezle.settings import CACHE_TIMEOUT_IN_SECONDS
 
 logger = logging.getLogger(__name__)
 
 
-class ArrayLength(models.Func):
-    function = 'CARDINALITY'
+def movie_cast_and_crew_key(movie_id):
+    return f'movie_cast_and_crew:{movie_id}'
 
 
-@cache(CACHE_TIMEOUT_IN_SECONDS)
-def get_movie_cast_and_crew(movie_id):
+def parse_movie_cast_and_crew(movie_id, credits):
     """
-    Returns a list of cast members from tmdb
+    Returns a list of cast members
     ordered by popularity
-    or raises HTTPError
+    from tmdb's movie credits
+    and caches everyone's info and the movie's credit ids
     """
-    tmdb.API_KEY = settings.TMDB_API_KEY
-    movie = tmdb.Movies(movie_id)
-    credits = movie.credits()
     cast = credits.get('cast', [])
     crew = credits.get('crew', [])
     credits = order_by_popularity_and_deduplicate(cast + crew)
 
     serializer = CrewMemberSerializer(data=credits, many=True)
     serializer.is_valid(raise_exception=True)
+    # Validated once here, then cached and served as plain dicts.
+    credits = [dict(person_data) for person_data in serializer.validated_data]
 
-    for person_data in serializer.validated_data:
-        get_persons_info(person_data['id'], force_cache=person_data)
+    primed = {(get_persons_info, (person_data['id'],)): person_data for person_data in credits}
+    primed[get_movie_credit_ids, (movie_id,)] = pack_ids(person_data['id'] for person_data in credits)
+    prime_cache(primed)
 
-    return serializer.validated_data
+    return credits
 
 
-@cache(CACHE_TIMEOUT_IN_SECONDS)
-def get_persons_filmography(person_id):
+@memoize(CACHE_TIMEOUT_IN_SECONDS, key=movie_cast_and_crew_key)
+def get_movie_cast_and_crew(movie_id):
     """
-    Returns a list of movies from tmdb
+    Returns a list of cast members from tmdb
     ordered by popularity
     or raises HTTPError
     """
-    tmdb.API_KEY = settings.TMDB_API_KEY
-    person = tmdb.People(person_id)
-    credits = person.movie_credits()
+    return parse_movie_cast_and_crew(movie_id, get_client().movie_credits(movie_id))
+
+
+@get_movie_cast_and_crew.coroutine
+async def aget_movie_cast_and_crew(movie_id):
+    return parse_movie_cast_and_crew(movie_id, await get_async_client().movie_credits(movie_id))
+
+
+def persons_filmography_key(person_id):
+    return f'persons_filmography:{person_id}'
+
+
+def parse_persons_filmography(person_id, credits):
+    """
+    Returns a list of movies
+    ordered by popularity
+    from tmdb's person movie credits
+    and caches every movie's info and the person's credit ids
+    """
     cast = credits.get('cast', [])
     crew = credits.get('crew', [])
     credits = order_by_popularity_and_deduplicate(cast + crew)
 
     serializer = MovieCreditSerializer(data=credits, many=True)
     serializer.is_valid(raise_exception=True)
+    # Validated once here, then cached and served as plain dicts.
+    credits = [dict(movie_data) for movie_data in serializer.validated_data]
 
-    for movie_data in serializer.validated_data:
-        get_movie_info(movie_data['id'], force_cache=movie_data)
+    primed = {(get_movie_info, (movie_data['id'],)): movie_data for movie_data in credits}
+    primed[get_person_credit_ids, (person_id,)] = pack_ids(movie_data['id'] for movie_data in credits)
+    prime_cache(primed)
 
-    return serializer.validated_data
+    return credits
 
 
-@cache(
-    CACHE_TIMEOUT_IN_SECONDS,
-    # Allows force_cache to work
-    key_generator_callable=lambda *args, **kwargs: 'movie_info' + str(args[0])
-)
-def get_movie_info(movie_id, force_cache=None):
+@memoize(CACHE_TIMEOUT_IN_SECONDS, key=persons_filmography_key)
+def get_persons_filmography(person_id):
     """
-    Returns info about a movie from tmdb
+    Returns a list of movies from tmdb
     ordered by popularity
     or raises HTTPError
     """
-    if force_cache:
-        return force_cache
+    return parse_persons_filmography(person_id, get_client().person_movie_credits(person_id))
+
+
+@get_persons_filmography.coroutine
+async def aget_persons_filmography(person_id):
+    return parse_persons_filmography(person_id, await get_async_client().person_movie_credits(person_id))
+
+
+def movie_info_key(movie_id):
+    return f'movie_info:{movie_id}'
+
+
+def persons_info_key(person_id):
+    return f'persons_info:{person_id}'
 
-    tmdb.API_KEY = settings.TMDB_API_KEY
-    movie = tmdb.Movies(movie_id)
 
-    serializer = MovieCreditSerializer(
-        data=movie.info())
+def parse_info(serializer_class, info):
+    serializer = serializer_class(data=info)
     serializer.is_valid(raise_exception=True)
 
-    return serializer.validated_data
+    return dict(serializer.validated_data)
 
 
-@cache(
-    CACHE_TIMEOUT_IN_SECONDS,
-    # Allows force_cache to work
-    key_generator_callable=lambda *args, **kwargs: 'persons_info' + \
-    str(args[0]),
-)
-def get_persons_info(person_id, force_cache=None):
+@memoize(CACHE_TIMEOUT_IN_SECONDS, key=movie_info_key)
+def get_movie_info(movie_id):
+    """
+    Returns info about a movie from tmdb
+    ordered by popularity
+    or raises HTTPError
+    """
+    return parse_info(MovieCreditSerializer, get_client().movie_info(movie_id))
+
+
+@get_movie_info.coroutine
+async def aget_movie_info(movie_id):
+    return parse_info(MovieCreditSerializer, await get_async_client().movie_info(movie_id))
+
+
+@memoize(CACHE_TIMEOUT_IN_SECONDS, key=persons_info_key)
+def get_persons_info(person_id):
     """
     Returns info about a person from tmdb
     or raises HTTPError
     """
-    if force_cache:
-        return force_cache
+    return parse_info(CrewMemberSerializer, get_client().person_info(person_id))
 
-    tmdb.API_KEY = settings.TMDB_API_KEY
-    person = tmdb.People(person_id)
 
-    serializer = CrewMemberSerializer(
-        data=person.info())
-    serializer.is_valid(raise_exception=True)
+@get_persons_info.coroutine
+async def aget_persons_info(person_id):
+    return parse_info(CrewMemberSerializer, await get_async_client().person_info(person_id))
 
-    return serializer.validated_data
 
+def pack_ids(ids):
+    """
+    Returns ids sorted and deduplicated in a compact array of C ints
+    """
+    return array('i', sorted(set(ids)))
 
-def find_puzzles_available(request):
+
+def contains_id(packed_ids, node_id):
+    """
+    Whether packed ids contain `node_id`, by binary search
+    """
+    index = bisect_left(packed_ids, node_id)
+    return index < len(packed_ids) and packed_ids[index] == node_id
+
+
+def intersect_ids(packed_ids, other_ids):
+    """
+    Returns the ids two packed arrays have in common, packed,
+    searching the longer for each id in the shorter
+    """
+    if len(packed_ids) > len(other_ids):
+        packed_ids, other_ids = other_ids, packed_ids
+    return array('i', (node_id for node_id in packed_ids if contains_id(other_ids, node_id)))
+
+
+def movie_credit_ids_key(movie_id):
+    return f'movie_credit_ids:{movie_id}'
+
+
+def person_credit_ids_key(person_id):
+    return f'person_credit_ids:{person_id}'
+
+
+@memoize(CACHE_TIMEOUT_IN_SECONDS, key=movie_credit_ids_key)
+def get_movie_credit_ids(movie_id):
+    """
+    Returns the packed ids of a movie's cast and crew,
+    cached apart from the full credits for adjacency checks
+    or raises HTTPError
+    """
+    return pack_ids(person_data['id'] for person_data in get_movie_cast_and_crew(movie_id))
+
+
+@memoize(CACHE_TIMEOUT_IN_SECONDS, key=person_credit_ids_key)
+def get_person_credit_ids(person_id):
+    """
+    Returns the packed ids of the movies in a person's filmography,
+    cached apart from the full filmography for adjacency checks
+    or raises HTTPError
+    """
+    return pack_ids(movie_data['id'] for movie_data in get_persons_filmography(person_id))
+
+
+def get_many_info(movie_ids=(), person_ids=()):
+    """
+    Returns a dict of cache key -> info for many movies and people,
+    read from the cache in one round trip.
+    Anything not cached is requested from tmdb concurrently
+    and cached in one more round trip,
+    or raises HTTPError
+    """
+    calls = [(get_movie_info, (movie_id,)) for movie_id in movie_ids]
+    calls += [(get_persons_info, (person_id,)) for person_id in person_ids]
+    return {func.key(*args): info for (func, args), info in call_many(calls).items()}
+
+
+def find_local_datetime(request):
     try:
-        local_datetime = datetime.datetime.now(
+        return datetime.datetime.now(
             pytz.timezone(get_client_timezone(request))
         )
     except:
-        local_datetime = datetime.datetime.now()
-    finally:
-        puzzles_available = Puzzle.objects.filter(
-            date_active__lte=local_datetime.date()
-        ).order_by('-date_active')
+        return datetime.datetime.now()
+
+
+def find_puzzles_available(request):
+    local_datetime = find_local_datetime(request)
+    puzzles_available = puzzle_schedule.available(local_datetime.date())
     return puzzles_available, local_datetime
 
 
 def find_puzzle_and_datetime(request, puzzle_id=None):
-    puzzles_available, local_datetime = find_puzzles_available(request)
+    local_datetime = find_local_datetime(request)
 
     if puzzle_id:
-        puzzle = puzzles_available.get(pk=puzzle_id)
+        puzzle = puzzle_schedule.get(puzzle_id, local_datetime.date())
     else:
-        puzzle = puzzles_available.first()
+        puzzle = puzzle_schedule.current(local_datetime.date())
 
     return puzzle, local_datetime
 
 
 def get_all_available_puzzles(request):
     puzzles, _ = find_puzzles_available(request)
+    return historical_puzzles(puzzles)
+
+
+def historical_puzzles(puzzles):
+    return [
+        {
+            'id': puzzle.id,
+            'datetime': puzzle.date_active.isoformat(),
+        } for puzzle in puzzles
+    ]
+
+
+def is_historical_puzzles_page_query(params):
+    """
+    Returns whether a query asks for a page of the historical puzzles,
+    ignoring anything else in it such as cache busters
+    """
+    return any(name in params for name in HistoricalPuzzleQuerySerializer().fields)
 
-    serializer = HistoricalPuzzleSerializer(
-        data=[
+
+def get_historical_puzzles_page(request, params):
+    """
+    Returns one page of available puzzles, most recent first,
+    paginated by a (date_active, id) cursor.
+    The compact form has parallel lists of ids and dates.
+    """
+    serializer = HistoricalPuzzleQuerySerializer(data=params)
+    serializer.is_valid(raise_exception=True)
+    query = serializer.validated_data
+
+    puzzles, next_cursor = puzzle_schedule.page(
+        find_local_datetime(request).date(),
+        query['limit'],
+        before=query.get('before'),
+        since=query.get('since'),
+        cursor=query.get('cursor'),
+    )
+    if next_cursor:
+        next_cursor = f'{next_cursor[0].isoformat()}.{next_cursor[1]}'
+
+    if query['compact']:
+        return {
+            'ids': [puzzle.id for puzzle in puzzles],
+            'dates': [puzzle.date_active.isoformat() for puzzle in puzzles],
+            'next': next_cursor,
+        }
+    return {
+        'results': [
             {
                 'id': puzzle.id,
                 'datetime': puzzle.date_active.isoformat(),
             } for puzzle in puzzles
         ],
-        many=True,
-    )
-    serializer.is_valid(raise_exception=True)
-
-    return serializer.validated_data
+        'next': next_cursor,
+    }
 
 
 def get_puzzle(request, puzzle_id=None):
     puzzle, local_datetime = find_puzzle_and_datetime(request, puzzle_id)
+    shared = get_shared_puzzle(puzzle)
+
+    # The client's local time is added fresh to every response.
+    return {
+        'id': shared['id'],
+        'start_movie': shared['start_movie'],
+        'end_movie': shared['end_movie'],
+        'local_datetime': local_datetime.strftime('%Y-%m-%d %H:%M:%S') if local_datetime else None,
+        'local_timezone': get_client_timezone(request),
+        'author': shared['author'],
+    }
+
 
-    serializer = PuzzleSerializer(
-        data={
+def get_shared_puzzle(puzzle):
+    """
+    Returns the parts of a puzzle's response that are the same for every client,
+    built once per puzzle and schedule version and kept in the cache.
+    """
+    key = f'puzzle_payload:{puzzle_schedule.version}:{puzzle.id}'
+    shared = caches['default'].get(key)
+    if shared is None:
+        info = get_many_info(movie_ids=[puzzle.start_movie_id, puzzle.end_movie_id])
+        # Everything here was validated when it came from tmdb or the database.
+        shared = {
             'id': puzzle.id,
-            'start_movie': get_movie_info(puzzle.start_movie_id),
-            'end_movie': get_movie_info(puzzle.end_movie_id),
-            'local_datetime': local_datetime.strftime('%Y-%m-%d %H:%M:%S') if local_datetime else None,
-            'local_timezone': get_client_timezone(request),
+            'start_movie': info[movie_info_key(puzzle.start_movie_id)],
+            'end_movie': info[movie_info_key(puzzle.end_movie_id)],
             'author': puzzle.author,
-        })
-    serializer.is_valid(raise_exception=True)
+        }
+        caches['default'].set(key, shared, CACHE_TIMEOUT_IN_SECONDS)
+    return shared
+
 
-    return serializer.validated_data
+def seconds_until_midnight(local_datetime):
+    seconds_today = local_datetime.hour * 3600 + local_datetime.minute * 60 + local_datetime.second
+    return max(24 * 3600 - seconds_today, 1)
+
+
+def render_payload(key, build, timeout):
+    """
+    Returns (content, etag) for the JSON rendering of `build()`,
+    rendered once and kept in the cache under `key`.
+    """
+    payload = caches['default'].get(key)
+    if payload is None:
+        content = JSONRenderer().render(build())
+        payload = (content, f'"{hashlib.sha1(content).hexdigest()}"')
+        caches['default'].set(key, payload, timeout)
+    return payload
+
+
+def get_all_available_puzzles_payload(request):
+    """
+    Returns (content, etag, max_age) for the historical puzzles,
+    rendered once per local date.
+    """
+    local_datetime = find_local_datetime(request)
+    max_age = seconds_until_midnight(local_datetime)
+    key = ':'.join([
+        'historical_payload',
+        puzzle_schedule.version,
+        local_datetime.date().isoformat(),
+    ])
+    content, etag = render_payload(key, lambda: get_all_available_puzzles(request), max_age)
+    return content, etag, max_age
 
 
 def get_solution(token):
     solution = Solution.objects.get(token=token)
+    # Solutions alternate between movies and people, starting with a movie.
+    info = get_many_info(
+        movie_ids=solution.solution[0::2],
+        person_ids=solution.solution[1::2],
+    )
     return {
         'token': solution.token,
-        'puzzle': solution.puzzle.id,
+        'puzzle': solution.puzzle_id,
         'length': solution.num_degrees,
         'solution': [
-            get_movie_info(id) if index % 2 == 0 else get_persons_info(id)
+            info[movie_info_key(id)] if index % 2 == 0 else info[persons_info_key(id)]
             for index, id in enumerate(solution.solution)
         ]
     }
 
 
+def validate_solutions(data):
+    """
+    Checks many solutions to one puzzle without saving them.
+    Returns whether each is valid and why not.
+    """
+    # api.paths imports this module.
+    from api.paths import PathChecker
+
+    serializer = SolutionValidationSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    puzzle = serializer.validated_data['puzzle']
+
+    checker = PathChecker()
+    results = []
+    for solution in serializer.validated_data['solutions']:
+        errors = checker.errors(puzzle, solution)
+        results.append({'valid': not errors, 'errors': errors})
+    return {
+        'puzzle': puzzle.id,
+        'results': results,
+    }
+
+
 def get_puzzle_metrics(request, puzzle_id=None):
     puzzle, _ = find_puzzle_and_datetime(request, puzzle_id)
+    metrics = current_puzzle_metrics(puzzle)
     return {
         'id': puzzle.id,
-        'num_solved': puzzle.num_solved,
-        'shortest_solution': puzzle.shortest_solution,
-        'longest_solution': puzzle.longest_solution,
-        'average_steps': puzzle.average_steps,
-        'median_steps': puzzle.median_steps,
+        'num_solved': metrics.num_solved,
+        'shortest_solution': metrics.shortest_solution,
+        'longest_solution': metrics.longest_solution,
+        'average_steps': metrics.average_steps,
+        'median_steps': metrics.median_steps,
     }
 
 
@@ -213,17 +446,21 @@ def get_solution_metrics(token):
         solution_length=ArrayLength('solution')
     ).order_by('solution_length')
 
+    shortest = solutions_ordered_by_length.first()
+    longest = solutions_ordered_by_length.last()
+    metrics = current_puzzle_metrics(puzzle)
+
     return {
         'token': solution.token,
-        'shortest_solution_steps': solutions_ordered_by_length.first().num_degrees,
-        'longest_solution_steps': solutions_ordered_by_length.last().num_degrees,
-        'shortest_solution_token': solutions_ordered_by_length.first().token,
-        'longest_solution_token': solutions_ordered_by_length.last().token,
-        'count': solution.count - 1,
+        'shortest_solution_steps': shortest.num_degrees,
+        'longest_solution_steps': longest.num_degrees,
+        'shortest_solution_token': shortest.token,
+        'longest_solution_token': longest.token,
+        'count': current_solution_count(solution) - 1,
         'num_steps':  solution.num_degrees,
-        'num_solved': puzzle.num_solved,
-        'average_steps': puzzle.average_steps,
-        'median_steps': puzzle.median_steps,
+        'num_solved': metrics.num_solved,
+        'average_steps': metrics.average_steps,
+        'median_steps': metrics.median_steps,
     }
 
 
@@ -239,16 +476,36 @@ def api_exception_handler(exc, context):
         logger.warning(f'DB ID Not Found')
         return Response(status=status.HTTP_404_NOT_FOUND)
 
-    if isinstance(exc, HTTPError):
-        if exc.response.status_code == 404:
+    tmdb_status = tmdb_error_status(exc)
+    if tmdb_status:
+        return Response(status=tmdb_status)
+
+    # returns response as handled normally by the framework
+    return response
+
+
+def tmdb_error_status(exc):
+    """
+    Returns the status to respond with when a request to tmdb failed,
+    or None if `exc` isn't one
+    """
+    if isinstance(exc, (HTTPError, httpx.HTTPStatusError)):
+        if exc.response is not None and exc.response.status_code == 404:
             logger.warning(f'Object ID Not Found {exc.request.url}')
-            return Response(status=status.HTTP_404_NOT_FOUND)
+            return status.HTTP_404_NOT_FOUND
         else:
             logger.warning('TMDB failed. Possible invalid key')
-            return Response(status=status.HTTP_502_BAD_GATEWAY)
+            return status.HTTP_502_BAD_GATEWAY
 
-    # returns response as handled normally by the framework
-    return response
+    if isinstance(exc, TMDBUnavailable):
+        logger.warning(f'TMDB circuit breaker is open {exc}')
+        return status.HTTP_503_SERVICE_UNAVAILABLE
+
+    if isinstance(exc, (RequestException, httpx.HTTPError)):
+        logger.warning(f'TMDB could not be reached {exc!r}')
+        return status.HTTP_502_BAD_GATEWAY
+
+    return None
 
 
 def order_by_popularity_and_deduplicate(items):
@@ -265,9 +522,35 @@ def get_client_ip(request):
     return ip
 
 
-def get_client_timezone(request):
+DEFAULT_TIMEZONE = 'America/Los_Angeles'
+
+
+@functools.lru_cache(maxsize=None)
+def get_geoip():
+    """
+    Returns the process-wide GeoIP2 reader, with the database memory-mapped,
+    or None if the database can't be opened.
+    """
     try:
-        timezone = GeoIP2().city(get_client_ip(request))['time_zone']
+        return GeoIP2(cache=GeoIP2.MODE_MMAP)
+    except Exception:
+        logger.warning('GeoIP database could not be opened')
+        return None
+
+
+@functools.lru_cache(maxsize=settings.GEOIP_CACHE_SIZE)
+def get_ip_timezone(ip):
+    try:
+        return get_geoip().city(ip)['time_zone'] or DEFAULT_TIMEZONE
     except:
-        timezone = 'America/Los_Angeles'
+        return DEFAULT_TIMEZONE
+
+
+def get_client_timezone(request):
+    """
+    Returns the client's timezone, looked up at most once per request.
+    """
+    timezone = getattr(request, 'client_timezone', None)
+    if timezone is None:
+        timezone = request.client_timezone = get_ip_timezone(get_client_ip(request))
     return timezone
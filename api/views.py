@@ -1,70 +1,98 @@
+import logging
+
 from api.serializers import SolutionSerializer
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.serializers import ValidationError
 from rest_framework.views import APIView
 
+from api.analysis import get_puzzle_paths_metrics
 from api.utils import (
-    get_movie_cast_and_crew,
-    get_persons_filmography,
-    get_persons_info,
-    get_movie_info,
+    aget_movie_cast_and_crew,
+    aget_persons_filmography,
+    aget_persons_info,
+    aget_movie_info,
     get_puzzle,
     get_puzzle_metrics,
     get_solution,
     get_solution_metrics,
-    get_all_available_puzzles,
+    get_all_available_puzzles_payload,
+    get_historical_puzzles_page,
+    is_historical_puzzles_page_query,
+    tmdb_error_status,
+    validate_solutions,
 )
 
+logger = logging.getLogger(__name__)
+
 
-class MovieCrewAPI(APIView):
+def cacheable_response(request, content, etag, max_age):
     """
-    View to list all cast members for the movie on tmdb
-    ordered by popularity.
+    Serves pre-rendered JSON with an ETag, answering conditional requests with a 304.
+    Responses depend on the timezone found from the client's IP,
+    so shared caches must keep one copy per client address.
     """
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=max_age)
+    patch_vary_headers(response, ['X-Forwarded-For'])
+    return response
 
-    def get(self, _, movie_id):
-        """
-        Return a list of cast members for the movie on tmdb
-        ordered by popularity.
-        """
-        return Response(get_movie_cast_and_crew(movie_id))
+
+async def json_response(request, get, *args):
+    """
+    Renders the result of `await get(*args)` for a GET like a REST framework Response,
+    mapping tmdb failures to the statuses api_exception_handler would.
+    REST framework has no async views and Django's method decorators
+    aren't async-aware before 5.0, so these views skip both.
+    """
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        return HttpResponseNotAllowed(['GET', 'HEAD', 'OPTIONS'])
+    try:
+        data = await get(*args)
+    except ValidationError as exc:
+        logger.warning('TMDB response returned unexpected format')
+        return HttpResponse(JSONRenderer().render(exc.detail), status=400, content_type='application/json')
+    except Exception as exc:
+        tmdb_status = tmdb_error_status(exc)
+        if tmdb_status is None:
+            raise
+        return HttpResponse(status=tmdb_status)
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json')
 
 
-class FilmographyAPI(APIView):
+async def movie_crew(request, movie_id):
     """
-    View to list all movies for the person on tmdb
+    Return a list of cast members for the movie on tmdb
     ordered by popularity.
     """
+    return await json_response(request, aget_movie_cast_and_crew, movie_id)
 
-    def get(self, _, person_id):
-        """
-        Return a list of movies for the person on tmdb
-        ordered by popularity.
-        """
-        return Response(get_persons_filmography(person_id))
 
+async def filmography(request, person_id):
+    """
+    Return a list of movies for the person on tmdb
+    ordered by popularity.
+    """
+    return await json_response(request, aget_persons_filmography, person_id)
 
-class PersonInfoAPI(APIView):
+
+async def person_info(request, person_id):
     """
     View info about a specific person on tmdb.
     """
-
-    def get(self, _, person_id):
-        """
-        View info about a specific person on tmdb.
-        """
-        return Response(get_persons_info(person_id))
+    return await json_response(request, aget_persons_info, person_id)
 
 
-class MovieInfoAPI(APIView):
+async def movie_info(request, movie_id):
     """
     View info about a specific movie on tmdb.
     """
-
-    def get(self, _, movie_id):
-        """
-        View info about a specific movie on tmdb.
-        """
-        return Response(get_movie_info(movie_id))
+    return await json_response(request, aget_movie_info, movie_id)
 
 
 class PuzzleAPI(APIView):
@@ -102,6 +130,18 @@ class SolutionAPI(APIView):
         })
 
 
+class SolutionValidationAPI(APIView):
+    """
+    Check solutions to a puzzle without saving them.
+    """
+
+    def post(self, request):
+        """
+        Check every path in `solutions` against `puzzle`.
+        """
+        return Response(validate_solutions(request.data))
+
+
 class HistoricalPuzzleAPI(APIView):
     """
     View historical puzzles and their dates.
@@ -109,9 +149,12 @@ class HistoricalPuzzleAPI(APIView):
 
     def get(self, request):
         """
-        Get the solution to a puzzle given a token.
+        Get every available puzzle, or one page of them when
+        any of `limit`, `before`, `since`, `cursor` or `compact` are given.
         """
-        return Response(get_all_available_puzzles(request))
+        if is_historical_puzzles_page_query(request.query_params):
+            return Response(get_historical_puzzles_page(request, request.query_params))
+        return cacheable_response(request, *get_all_available_puzzles_payload(request))
 
 
 class PuzzleMetricsAPI(APIView):
@@ -126,6 +169,19 @@ class PuzzleMetricsAPI(APIView):
         return Response(get_puzzle_metrics(request, puzzle_id))
 
 
+class PuzzlePathsMetricsAPI(APIView):
+    """
+    View how many shortest paths a puzzle has.
+    """
+
+    def get(self, request, puzzle_id=None):
+        """
+        Get the number of shortest paths between a puzzle's films and a few of them,
+        as counted offline by count_puzzle_paths, or a 404 if they haven't been.
+        """
+        return Response(get_puzzle_paths_metrics(request, puzzle_id))
+
+
 class SolutionMetricsAPI(APIView):
     """
     View metrics about the current solution.
@@ -159,11 +159,61 @@ TIME_ZONE = 'UTC'
 
 USE_I18N = True
 
-USE_L10N = True
-
 USE_TZ = True
 
+# TMDB results are fresh for CACHE_TIMEOUT_IN_SECONDS, then served while
+# being refreshed in the background until CACHE_HARD_TIMEOUT_IN_SECONDS,
+# after which requests wait for fresh results.
 CACHE_TIMEOUT_IN_SECONDS = 60 * 60 * 24
+CACHE_HARD_TIMEOUT_IN_SECONDS = 60 * 60 * 24 * 3
+
+# How much longer hard expired TMDB results are kept,
+# to be served while TMDB is unavailable.
+CACHE_STALE_TIMEOUT_IN_SECONDS = 60 * 60 * 24 * 7
+
+# Write the info of everyone in a credit list to the cache
+# after the response instead of before it.
+CACHE_PRIME_IN_BACKGROUND = True
+
+# Buffer repeat submissions of a solution in memory and write them
+# to the database every SOLUTION_FLUSH_INTERVAL_IN_SECONDS.
+SOLUTION_WRITE_BEHIND = False
+SOLUTION_FLUSH_INTERVAL_IN_SECONDS = 5
+
+# Threads used by the solver to expand a BFS level,
+# and the most requests it may have open to TMDB at once.
+SOLVER_MAX_WORKERS = 16
+TMDB_MAX_CONNECTIONS = 8
+
+# Puzzle analysis counts the shortest paths up to this many steps long,
+# and shows this many of them picked at random. The counts are made offline
+# by the count_puzzle_paths command and kept this long.
+PUZZLE_PATHS_MAX_STEPS = 6
+PUZZLE_PATHS_SAMPLES = 5
+PUZZLE_PATHS_TIMEOUT_IN_SECONDS = 60 * 60 * 24 * 30
+
+# (connect, read) timeouts for TMDB requests, how many times to retry
+# a 429, 5xx or connection error, and the backoff between retries.
+TMDB_TIMEOUT_IN_SECONDS = (3.05, 10)
+TMDB_RETRIES = 2
+TMDB_BACKOFF_IN_SECONDS = 0.5
+TMDB_MAX_BACKOFF_IN_SECONDS = 5
+
+# Stop calling TMDB after this many failed requests in a row,
+# and try again after TMDB_BREAKER_RESET_IN_SECONDS.
+TMDB_BREAKER_FAILURES = 5
+TMDB_BREAKER_RESET_IN_SECONDS = 30
+
+# Where the graph store and the file cache are written. It must be outside
+# the source tree, which the compose files bind-mount into the containers.
+DATA_DIR = parser.get(
+    'global', 'data_dir', fallback=os.environ.get('DATA_DIR', os.path.join(os.path.expanduser('~'), '.degreezle'))
+)
+
+# Local graph of films and people built from TMDB credits,
+# nodes older than this are requested from TMDB again.
+GRAPH_STORE_PATH = os.path.join(DATA_DIR, 'graph')
+GRAPH_STALE_AFTER_IN_SECONDS = 60 * 60 * 24 * 7
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
@@ -178,11 +228,34 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 TMDB_API_KEY = parser.get('global', 'tmdb_api_key')
 
+# A small in-process LRU in front of a cache shared by every process:
+# memcached when it's configured, otherwise files on local disk.
+MEMCACHED_LOCATION = parser.get(
+    'cache', 'memcached_location', fallback=os.environ.get('MEMCACHED_LOCATION')
+)
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
-        'LOCATION': 'django_cache',
-    }
+        'BACKEND': 'api.cache.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'LOCAL_TIMEOUT': 60,
+            'MAX_ENTRIES': 20000,
+            'MAX_SIZE': 64 * 1024 * 1024,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': MEMCACHED_LOCATION,
+    } if MEMCACHED_LOCATION else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(DATA_DIR, 'cache'),
+        # Every write lists the whole directory to cull it, so keep it small.
+        # Anything beyond development should use memcached.
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
 }
 
 CORS_ALLOWED_ORIGINS = [
@@ -197,3 +270,9 @@ CORS_ALLOWED_ORIGIN_REGEXES = [
 ]
 
 GEOIP_PATH = os.path.join(BASE_DIR, 'geoip2')
+
+# Client IPs whose timezone is remembered by each process.
+GEOIP_CACHE_SIZE = 10000
+
+# How often each process checks whether puzzles were changed elsewhere.
+PUZZLE_SCHEDULE_CHECK_INTERVAL_IN_SECONDS = 60
@@ -0,0 +1,48 @@
+"""
+Gunicorn settings for serving degreezle in production:
+
+    gunicorn -c gunicorn.conf.py degreezle.asgi:application
+
+Each worker runs uvicorn's event loop, so async views serve many tmdb
+requests at once, and Django runs each sync view in a thread of its own.
+WEB_CONCURRENCY overrides the worker count, which defaults to two per core.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Two workers per core: one keeps the core busy while the other is held up by
+# the GIL or the database. More only adds memory and cold caches.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2))
+
+# Import Django, numpy, DRF and open the GeoIP database once before forking,
+# so workers start fast and share those pages. Autoreload needs them unloaded.
+reload = bool(os.environ.get('GUNICORN_RELOAD'))
+preload_app = not reload
+
+# Replace each worker after about this many requests, staggered so they don't
+# all restart at once, to bound memory growth from caches and fragmentation.
+max_requests = 5000
+max_requests_jitter = 500
+
+# Workers silent for this long are killed, and on restart or shutdown
+# get this long to finish their requests and flush solution counts.
+timeout = 60
+graceful_timeout = 30
+
+# Longer than nginx keeps idle upstream connections (keepalive_timeout 60s),
+# so nginx always closes them first and never reuses one being closed here.
+keepalive = 75
+
+accesslog = '-'
+errorlog = '-'
+
+
+def worker_exit(server, worker):
+    """
+    Writes out buffered solution counts before the worker goes.
+    """
+    from api.counters import solution_counter
+    solution_counter.drain()